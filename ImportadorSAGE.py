@@ -1,8 +1,31 @@
 # -*- coding: utf-8 -*-
 
+import csv
+import ctypes
+import ctypes.util
+import fnmatch
+import hashlib
+import json
+import mmap
 import os
 import re
+import select
+import struct
+import sys
+import tempfile
+import threading
 import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import uno
+    import unohelper
+    from com.sun.star.sheet import XActivationEventListener
+    from com.sun.star.util import XModifyListener
+except ImportError:  # Fora do LibreOffice (ex.: testes em linha de comando)
+    uno = None
+    unohelper = None
 
 # ===============================================================
 # ================ MACRO SAGE - VERSÃO 0.9.1 ====================
@@ -29,9 +52,18 @@ NOME_ABA_MAIS_USADAS = "MaisUsadas"
 NOME_ABA_VALIDACAO = "EntidadeAtributoValor"
 NOME_ABA_OPMSK = "opmsk"
 NOME_ABA_CORES = "Cores"
+NOME_ABA_RELATORIO_VALIDACAO = "RelatorioValidacao"
+NOME_ABA_RESUMO_LOTE = "Lote"
+NOME_ABA_CENSO = "Censo"
+NOME_ABA_SIMUL = "simul"
+NOME_ABA_DIAGNOSTICO = "Diagnostico"
 
 # --- Lista de Abas a Ignorar ---
-FOLHAS_IGNORADAS = [NOME_ABA_GERAL, NOME_ABA_MAIS_USADAS, NOME_ABA_VALIDACAO, NOME_ABA_OPMSK, NOME_ABA_CORES]
+FOLHAS_IGNORADAS = [
+    NOME_ABA_GERAL, NOME_ABA_MAIS_USADAS, NOME_ABA_VALIDACAO, NOME_ABA_OPMSK, NOME_ABA_CORES,
+    NOME_ABA_RELATORIO_VALIDACAO, NOME_ABA_RESUMO_LOTE, NOME_ABA_CENSO, NOME_ABA_SIMUL,
+    NOME_ABA_DIAGNOSTICO
+]
 
 # --- Posições das Células na Aba "geral" ---
 CELULA_CAMINHO_IMPORTACAO = (0, 3)  # A4
@@ -39,6 +71,8 @@ CELULA_STATUS_IMPORTACAO = (1, 3)   # B4
 CELULA_CAMINHO_EXPORTACAO = (0, 6)  # A7
 CELULA_STATUS_EXPORTACAO = (1, 6)   # B7
 RANGE_ENTIDADES_PARCIAL = (2, 13, 2, 143) # C15:C145
+CELULA_ID_BACKUP = (0, 7)           # A8 (opcional: execução a restaurar; vazio = a mais recente)
+RANGE_LOTE_BASES = (7, 13, 8, 143)  # H14:I144 (pasta de entrada, pasta de saída) ou manifesto em H14
 
 # --- Códigos de Controle (Coluna "Gera") ---
 CODIGO_BLOCO_ATIVO = 'x'
@@ -52,30 +86,94 @@ CODIGO_INCLUDE_COMENTADO = 'u'
 CABEÇALHO_COLUNA_ORIGEM = "Origem"
 CABEÇALHO_COLUNA_CONTROLE = "Gera"
 CABEÇALHO_COLUNA_DADOS = "Comentario/Include"
+CABEÇALHO_COLUNA_ENTIDADE = "Entidade"  # Só existe nas abas agrupadas
+CABEÇALHO_COLUNA_POSICAO = "Posicao"    # Posição do bloco no arquivo de origem (ordem na exportação)
+CABEÇALHOS_FIXOS = [
+    CABEÇALHO_COLUNA_ORIGEM, CABEÇALHO_COLUNA_CONTROLE, CABEÇALHO_COLUNA_DADOS,
+    CABEÇALHO_COLUNA_ENTIDADE, CABEÇALHO_COLUNA_POSICAO
+]
+
+# --- Agrupamento de Entidades (aba "MaisUsadas") ---
+# Uma linha "grupo:<nome>" seguida das entidades faz com que todas compartilhem a aba <nome>.
+PREFIXO_GRUPO_MAIS_USADAS = "grupo:"
 
 # --- NOVO: Cores para Linhas Alternadas (Efeito Zebra) ---
 # Cores em formato numérico (Decimal de Hex BGR: Blue-Green-Red)
 COR_LINHA_PAR = 16777215   # Branco (0xFFFFFF)
 COR_LINHA_IMPAR = 15790320  # Cinza muito claro (0xF0F0F0)
+COR_CELULA_INVALIDA = 16762830  # Vermelho claro (0xFFC7CE) para valores fora da validação
+
+# --- Validação em Lote (aba "EntidadeAtributoValor") ---
+VALIDAR_ANTES_EXPORTACAO = True
+DESTACAR_CELULAS_INVALIDAS = True
+
+# --- Importação Sob Demanda ---
+# Texto gravado em A1 das abas ainda não materializadas (dados apenas em memória).
+MARCADOR_ABA_PENDENTE = "[SageBonis] Aba pendente: ative a aba ou use a macro materializar_abas."
+
+# --- Monitoramento da Pasta de Importação ---
+MONITOR_DEBOUNCE_SEGUNDOS = 1.0   # Silêncio exigido antes de reimportar uma rajada de alterações
+MONITOR_INTERVALO_POLLING = 2.0   # Intervalo de varredura quando inotify não está disponível
+
+# --- Armazenamento de Backups (pasta dentro da pasta de exportação) ---
+PASTA_BACKUP = ".sagebonis_backup"
+BACKUP_COMPRIMIR = True         # Comprime os objetos com zlib
+BACKUP_MAX_EXECUCOES = 30       # Execuções mantidas; as mais antigas (e objetos órfãos) são removidas
+
+# --- Extração das Abas na Exportação ---
+# 'csv': grava todas as abas de uma vez pelo filtro CSV do Calc e lê os arquivos com o módulo csv.
+# 'uno': lê cada aba com getDataArray. O modo 'csv' volta para 'uno' se o filtro falhar.
+EXTRACAO_EXPORTACAO = 'csv'
+# O filtro grava o documento inteiro; só compensa quando a exportação lê a maior parte das abas
+# de entidades. Abaixo dessa fração (ex.: exportar_parcial, exportar_alteradas) usa getDataArray.
+EXTRACAO_CSV_FRACAO_MINIMA = 0.5
+FILTRO_CSV_EXTRACAO = "Text - txt - csv (StarCalc)"
+# Vírgula, aspas, UTF-8 (76), a partir da linha 1, en-US (1033, ponto decimal), valores
+# sem formatação, todas as abas (-1), cada uma em <base>-<aba>.csv (LibreOffice 7.2+).
+OPCOES_FILTRO_CSV_EXTRACAO = "44,34,76,1,,1033,false,true,false,false,false,-1"
+NOME_BASE_EXTRACAO = "extracao"
+
+# --- Geração de Scripts de Simulação (aba "simul") ---
+NOME_ARQUIVO_SIMUL = "simul.txt"   # Gravado na pasta de exportação
+SIMUL_TAMANHO_BUFFER = 1000        # Linhas acumuladas em memória antes de cada escrita
+# Usados quando a aba "simul" não existe ou não tem templates. Campos entre chaves são
+# atributos do ponto; também há {ENTIDADE} e {ORIGEM}. Atributos ausentes ficam vazios.
+TEMPLATES_SIMUL_PADRAO = {
+    'pds': "{ENTIDADE} {ID} 0 ; {NOME}",
+    'pas': "{ENTIDADE} {ID} 0.0 ; {NOME}",
+}
+
+# --- Processamento em Lote ---
+LOTE_MAX_WORKERS = 4  # Número máximo de bases processadas em paralelo
 
 # --- Constantes Técnicas ---
 FLAGS_LIMPAR_TUDO = 1048575
-LIMITE_CARACTERES_VALIDACAO = 250 # Manteremos para a próxima etapa
 
 # --- Codificação dos Arquivos DAT do SAGE ---
 ENCODING_EXPORTACAO_SAGE = 'latin-1'  # ISO-8859-1 (padrão esperado pelo SAGE)
 ENCODINGS_IMPORTACAO_SAGE = ('latin-1', 'utf-8')  # Aceita os dois formatos na importação
 
 # --- Expressões Regulares ---
+# Nome de entidade (= nome de um .dat da pasta, ex.: pds, nv2, e2m). Compartilhado pelo parser
+# e pelo censo para que os dois reconheçam exatamente os mesmos inícios de bloco.
+PADRAO_NOME_ENTIDADE = r'[A-Za-z0-9_]+'
 REGEX_INCLUDE = re.compile(r'^\s*#\s*include\s+(.*)', re.IGNORECASE)
 REGEX_INCLUDE_COMENTADO = re.compile(r'^\s*;\s*#\s*include\s+(.*)', re.IGNORECASE)
-REGEX_INICIO_BLOCO_COMENTADO = re.compile(r'^\s*;\s*([A-Z_]+)\s*$', re.IGNORECASE)
+REGEX_INICIO_BLOCO_COMENTADO = re.compile(r'^\s*;\s*(' + PADRAO_NOME_ENTIDADE + r')\s*$', re.IGNORECASE)
+
+# --- Expressões Regulares em Bytes (censo sobre o arquivo mapeado em memória) ---
+REGEX_CENSO_INICIO_BLOCO = re.compile(
+    rb'^[ \t]*(;?)[ \t]*(' + PADRAO_NOME_ENTIDADE.encode('ascii') + rb')[ \t]*\r?$', re.MULTILINE
+)
+REGEX_CENSO_INCLUDE = re.compile(rb'^[ \t]*(;?)[ \t]*#[ \t]*include[ \t]', re.MULTILINE | re.IGNORECASE)
 
 # --- Debug/Diagnóstico de Importação ---
 DEBUG_IMPORTACAO = False
 LOG_IMPORTACAO_RESUMO = True
 LOG_IMPORTACAO_AVISOS = True
 WATCHDOG_MAX_ITERACOES_SEM_PROGRESSO = 1000
+DIAGNOSTICO_MAX_POR_CODIGO = 20     # Avisos detalhados por (arquivo, código); os demais só são contados
+DIAGNOSTICO_TAMANHO_TRECHO = 120    # Caracteres da linha guardados em cada aviso
 
 
 def _log_importacao(level, message, force=False):
@@ -93,6 +191,99 @@ def _log_importacao(level, message, force=False):
         print(f"[IMPORTACAO:{level}] {message}")
 
 
+class DiagnosticoImportacao:
+    """
+    Coletor dos avisos do parser. Guarda cada aviso como (arquivo, linha, código, trecho),
+    limitando a DIAGNOSTICO_MAX_POR_CODIGO os registros de cada (arquivo, código) e apenas
+    contando os excedentes. Pode ser compartilhado entre threads.
+    """
+    def __init__(self, max_por_codigo=DIAGNOSTICO_MAX_POR_CODIGO):
+        self.max_por_codigo = max_por_codigo
+        self.registros = []
+        self.contagens = {}  # {(arquivo, codigo): total de ocorrências}
+        self._lock = threading.Lock()
+
+    @property
+    def total(self):
+        return sum(self.contagens.values())
+
+    def registrar(self, arquivo, linha, codigo, trecho=''):
+        with self._lock:
+            chave = (arquivo, codigo)
+            ocorrencias = self.contagens.get(chave, 0) + 1
+            self.contagens[chave] = ocorrencias
+            if ocorrencias <= self.max_por_codigo:
+                self.registros.append((arquivo, linha, codigo, trecho[:DIAGNOSTICO_TAMANHO_TRECHO]))
+
+    def descartar_arquivos(self, arquivos):
+        """Esquece os avisos dos arquivos informados (usado antes de reprocessá-los)."""
+        arquivos = set(arquivos)
+        with self._lock:
+            self.registros = [r for r in self.registros if r[0] not in arquivos]
+            self.contagens = {k: v for k, v in self.contagens.items() if k[0] not in arquivos}
+
+    def incorporar(self, outro, prefixo=''):
+        """Acrescenta os avisos de outro coletor, prefixando os caminhos (ex.: com a pasta da base)."""
+        with self._lock:
+            for arquivo, linha, codigo, trecho in outro.registros:
+                self.registros.append((os.path.join(prefixo, arquivo), linha, codigo, trecho))
+            for (arquivo, codigo), ocorrencias in outro.contagens.items():
+                chave = (os.path.join(prefixo, arquivo), codigo)
+                self.contagens[chave] = self.contagens.get(chave, 0) + ocorrencias
+
+    def resumo(self):
+        arquivos = {arquivo for arquivo, _ in self.contagens}
+        return f"{self.total} aviso(s) de importação em {len(arquivos)} arquivo(s)"
+
+    def publicar(self, doc):
+        """
+        Recria a aba de diagnóstico com um único setDataArray: os avisos detalhados, uma linha
+        por (arquivo, código) com as ocorrências omitidas e o total por código. Sem avisos,
+        apenas remove a aba anterior.
+        """
+        sheets = doc.getSheets()
+        if sheets.hasByName(NOME_ABA_DIAGNOSTICO):
+            sheets.removeByName(NOME_ABA_DIAGNOSTICO)
+        with self._lock:
+            registros = list(self.registros)
+            contagens = dict(self.contagens)
+        if not contagens:
+            return
+        sheets.insertNewByName(NOME_ABA_DIAGNOSTICO, sheets.getCount())
+        sheet = sheets.getByName(NOME_ABA_DIAGNOSTICO)
+
+        linhas = [(arquivo, linha, codigo, trecho) for arquivo, linha, codigo, trecho in registros]
+        for (arquivo, codigo), ocorrencias in contagens.items():
+            if ocorrencias > self.max_por_codigo:
+                linhas.append((arquivo, "", codigo, f"(+{ocorrencias - self.max_por_codigo} ocorrência(s) omitida(s))"))
+        linhas.sort(key=lambda r: (r[0], r[1] if r[1] != "" else float('inf')))
+
+        totais = {}
+        for (_, codigo), ocorrencias in contagens.items():
+            totais[codigo] = totais.get(codigo, 0) + ocorrencias
+        data_matrix = [("Arquivo", "Linha", "Código", "Trecho")] + linhas
+        for codigo in sorted(totais):
+            data_matrix.append(("TOTAL", "", codigo, totais[codigo]))
+        sheet.getCellRangeByPosition(0, 0, len(data_matrix[0]) - 1, len(data_matrix) - 1).setDataArray(tuple(data_matrix))
+        columns = sheet.getColumns()
+        for i in range(len(data_matrix[0])):
+            columns.getByIndex(i).OptimalWidth = True
+
+
+def _avisar_importacao(diagnostico, relative_path, line_no, codigo, mensagem, trecho=''):
+    """Envia o aviso ao coletor de diagnóstico ou, sem coletor, direto ao log."""
+    if diagnostico is None:
+        _log_importacao('WARN', f"{relative_path}:{line_no} {mensagem}", force=True)
+    else:
+        diagnostico.registrar(relative_path, line_no, codigo, trecho)
+
+
+def _sufixo_diagnostico(diagnostico):
+    if not diagnostico or not diagnostico.total:
+        return ""
+    return f" AVISO: {diagnostico.resumo()} (aba '{NOME_ABA_DIAGNOSTICO}')."
+
+
 def _classificar_linha_dat(raw_line, entidades_validas):
     """Classifica a linha do arquivo DAT para manter o parser determinístico."""
     original_line = raw_line.strip('\r\n')
@@ -212,7 +403,7 @@ def _iniciar_bloco(entidade_nome, tipo_bloco, relative_path, comentarios_iniciai
     return bloco
 
 
-def _finalizar_bloco(current_block, all_data, relative_path, stats, line_no):
+def _finalizar_bloco(current_block, all_data, relative_path, stats, line_no, diagnostico=None):
     if not current_block:
         return
 
@@ -228,25 +419,43 @@ def _finalizar_bloco(current_block, all_data, relative_path, stats, line_no):
 
     if not current_block['attributes']:
         stats['warnings'] += 1
-        _log_importacao(
-            'WARN',
-            f"{relative_path}:{line_no} bloco {current_block['identifier']} finalizado sem atributos.",
-            force=True
+        _avisar_importacao(
+            diagnostico, relative_path, line_no, 'BLOCO_SEM_ATRIBUTOS',
+            f"bloco {current_block['identifier']} finalizado sem atributos.", current_block['identifier']
         )
 
     if current_block['attributes'] and 'ID' not in current_block['attributes']:
         stats['warnings'] += 1
-        _log_importacao(
-            'WARN',
-            f"{relative_path}:{line_no} bloco {current_block['identifier']} finalizado sem ID.",
-            force=True
+        _avisar_importacao(
+            diagnostico, relative_path, line_no, 'BLOCO_SEM_ID',
+            f"bloco {current_block['identifier']} finalizado sem ID.", current_block['identifier']
         )
 
     if current_block['attributes'] or current_block['comments']:
         chave = current_block['identifier'].lower()
+        ponto['posicao'] = stats['points']
+        stats['points'] += 1
         all_data.setdefault(chave, []).append(ponto)
         stats['entities_imported'] += 1
 
+# ===============================================================
+# ================ FUNÇÕES AUXILIARES DE PLANILHA ===============
+# ===============================================================
+
+def _ler_dados_folha(sheet):
+    """Lê toda a área usada da aba com um único getDataArray."""
+    cursor = sheet.createCursor()
+    cursor.gotoEndOfUsedArea(False)
+    data_range = cursor.getRangeAddress()
+    return sheet.getCellRangeByPosition(0, 0, data_range.EndColumn, data_range.EndRow).getDataArray()
+
+
+def _valor_celula_para_texto(valor):
+    """Converte o valor vindo do getDataArray em texto (1.0 -> '1')."""
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return str(valor)
+
 # ===============================================================
 # =================== CLASSE DE CONFIGURAÇÃO ====================
 # ===============================================================
@@ -258,15 +467,16 @@ class SageConfig:
         self.ordem_entidades = []
         self.cores_entidades = {}
         self.ordem_atributos = {}
-        self.regras_validacao = {} # Mantido por segurança, mas não será preenchido
+        self.regras_validacao = {} # {entidade: {ATRIBUTO: {VALORES PERMITIDOS}}}
+        self.grupos_entidades = {} # {grupo: [entidades]}
+        self.grupo_por_entidade = {}
         
         self._carregar_configuracoes()
 
     def _carregar_configuracoes(self):
         """Método principal para chamar os carregadores."""
         self._carregar_mais_usadas()
-        # A LINHA ABAIXO FOI REMOVIDA:
-        # self._carregar_validacao()
+        self._carregar_validacao()
 
     def _carregar_mais_usadas(self):
         """Lê a aba 'MaisUsadas' para obter ordem, cores e atributos prioritários."""
@@ -284,6 +494,10 @@ class SageConfig:
                 entidade_nome = str(row_data[0]).lower().strip()
                 if not entidade_nome: continue
 
+                if entidade_nome.startswith(PREFIXO_GRUPO_MAIS_USADAS):
+                    self._carregar_grupo(sheet, row_idx, entidade_nome, row_data)
+                    continue
+
                 self.ordem_entidades.append(entidade_nome)
                 cell = sheet.getCellByPosition(0, row_idx)
                 self.cores_entidades[entidade_nome] = cell.CellBackColor
@@ -293,7 +507,49 @@ class SageConfig:
         except Exception as e:
             print(f"AVISO: Não foi possível carregar as configurações da aba '{NOME_ABA_MAIS_USADAS}'. {e}")
 
-    # A FUNÇÃO _carregar_validacao FOI COMPLETAMENTE REMOVIDA DESTA CLASSE
+    def _carregar_grupo(self, sheet, row_idx, celula_grupo, row_data):
+        """Registra um grupo: ele ocupa a posição da linha na ordem das abas e usa a cor da célula."""
+        nome_grupo = celula_grupo[len(PREFIXO_GRUPO_MAIS_USADAS):].strip()
+        membros = [str(v).lower().strip() for v in row_data[1:] if str(v).strip()]
+        if not nome_grupo or not membros: return
+
+        self.ordem_entidades.append(nome_grupo)
+        self.cores_entidades[nome_grupo] = sheet.getCellByPosition(0, row_idx).CellBackColor
+        self.grupos_entidades[nome_grupo] = membros
+        for entidade_nome in membros:
+            self.grupo_por_entidade.setdefault(entidade_nome, nome_grupo)
+
+    def aba_da_entidade(self, entidade_nome):
+        """Nome da aba onde a entidade é exibida (o grupo, se houver)."""
+        return self.grupo_por_entidade.get(entidade_nome, entidade_nome)
+
+    def entidades_da_aba(self, sheet_name):
+        """Entidades exibidas na aba (os membros, se for uma aba agrupada)."""
+        return self.grupos_entidades.get(sheet_name, [sheet_name])
+
+    def _carregar_validacao(self):
+        """
+        Lê a aba 'EntidadeAtributoValor' uma única vez e monta, para cada entidade
+        e atributo, o conjunto de valores permitidos (comparação sem diferenciar maiúsculas).
+        """
+        try:
+            sheets = self.doc.getSheets()
+            if not sheets.hasByName(NOME_ABA_VALIDACAO): return
+            data = _ler_dados_folha(sheets.getByName(NOME_ABA_VALIDACAO))
+
+            if not data or len(data) < 2: return
+
+            for row_data in data[1:]:
+                if len(row_data) < 3 or not row_data[0] or not row_data[1]: continue
+                entidade_nome = str(row_data[0]).lower().strip()
+                atributo = str(row_data[1]).upper().strip()
+                valores = {_valor_celula_para_texto(v).strip().upper() for v in row_data[2:] if v != ''}
+                valores.discard('')
+                if entidade_nome and atributo and valores:
+                    regras_entidade = self.regras_validacao.setdefault(entidade_nome, {})
+                    regras_entidade.setdefault(atributo, set()).update(valores)
+        except Exception as e:
+            print(f"AVISO: Não foi possível carregar as regras da aba '{NOME_ABA_VALIDACAO}'. {e}")
 
 # ===============================================================
 # ================= FUNÇÕES DE IMPORTAÇÃO =======================
@@ -314,8 +570,10 @@ def importar_dats(*args):
         return
 
     geral_sheet.getCellByPosition(*CELULA_STATUS_IMPORTACAO).setString("Processando importação total...")
-    _executar_importacao(doc, folder_path, lista_entidades=None, modo_importacao='REPLACE')
-    geral_sheet.getCellByPosition(*CELULA_STATUS_IMPORTACAO).setString("Importação total concluída com sucesso!")
+    diagnostico = _executar_importacao(doc, folder_path, lista_entidades=None, modo_importacao='REPLACE')
+    geral_sheet.getCellByPosition(*CELULA_STATUS_IMPORTACAO).setString(
+        "Importação total concluída com sucesso!" + _sufixo_diagnostico(diagnostico)
+    )
 
 
 def importar_parcial(*args):
@@ -350,20 +608,107 @@ def importar_parcial(*args):
         modo = 'UPDATE'
 
     geral_sheet.getCellByPosition(*CELULA_STATUS_IMPORTACAO).setString(f"Processando importação de: {', '.join(entidades_a_importar)}...")
-    _executar_importacao(doc, folder_path, lista_entidades=entidades_a_importar, modo_importacao=modo)
-    geral_sheet.getCellByPosition(*CELULA_STATUS_IMPORTACAO).setString("Importação parcial concluída com sucesso!")
+    diagnostico = _executar_importacao(doc, folder_path, lista_entidades=entidades_a_importar, modo_importacao=modo)
+    geral_sheet.getCellByPosition(*CELULA_STATUS_IMPORTACAO).setString(
+        "Importação parcial concluída com sucesso!" + _sufixo_diagnostico(diagnostico)
+    )
 
 
-def _executar_importacao(doc, base_folder_path, lista_entidades, modo_importacao):
+def importar_dats_sob_demanda(*args):
+    """
+    Importação total "preguiçosa": faz o parse de toda a base para a memória, mas cria
+    apenas abas vazias. Cada aba é preenchida quando o usuário a ativa (ou pela macro
+    materializar_abas); a exportação usa os dados em memória das abas não materializadas.
+    """
+    doc = XSCRIPTCONTEXT.getDocument() # type: ignore
+    try:
+        geral_sheet = doc.getSheets().getByName(NOME_ABA_GERAL)
+        path_cell = geral_sheet.getCellByPosition(*CELULA_CAMINHO_IMPORTACAO)
+        folder_path = path_cell.getString()
+        if not os.path.isdir(folder_path):
+            geral_sheet.getCellByPosition(*CELULA_STATUS_IMPORTACAO).setString("ERRO: O caminho especificado não é uma pasta válida.")
+            return
+    except Exception as e:
+        geral_sheet.getCellByPosition(*CELULA_STATUS_IMPORTACAO).setString(f"ERRO: Falha ao ler configurações. {e}") # type: ignore
+        return
+
+    geral_sheet.getCellByPosition(*CELULA_STATUS_IMPORTACAO).setString("Processando importação sob demanda...")
+    diagnostico = _executar_importacao(doc, folder_path, lista_entidades=None, modo_importacao='REPLACE', sob_demanda=True)
+    pendentes = len(_estado_documento(doc)['pendentes'])
+    geral_sheet.getCellByPosition(*CELULA_STATUS_IMPORTACAO).setString(
+        f"Importação sob demanda concluída: {pendentes} aba(s) serão preenchidas ao serem abertas."
+        + _sufixo_diagnostico(diagnostico)
+    )
+
+
+def materializar_abas(*args):
+    """
+    Preenche as abas pendentes da importação sob demanda: a aba ativa, ou, na aba 'geral',
+    as entidades listadas (todas as pendentes se a lista estiver vazia).
+    """
+    doc = XSCRIPTCONTEXT.getDocument() # type: ignore
+    geral_sheet = doc.getSheets().getByName(NOME_ABA_GERAL)
+    active_sheet_name = doc.getCurrentController().getActiveSheet().getName()
+    pendentes = _estado_documento(doc)['pendentes']
+
+    if active_sheet_name.lower() == NOME_ABA_GERAL.lower():
+        config = _estado_documento(doc)['config']
+        dados_entidades = geral_sheet.getCellRangeByPosition(*RANGE_ENTIDADES_PARCIAL).getDataArray()
+        nomes = [row[0].lower() for row in dados_entidades if row and row[0]]
+        if config:
+            nomes = list(dict.fromkeys(config.aba_da_entidade(nome) for nome in nomes))
+        abas = [nome for nome in nomes if nome in pendentes] if nomes else list(pendentes)
+    else:
+        abas = [active_sheet_name] if active_sheet_name in pendentes else []
+
+    for sheet_name in abas:
+        _materializar_aba(doc, sheet_name)
+    geral_sheet.getCellByPosition(*CELULA_STATUS_IMPORTACAO).setString(
+        f"{len(abas)} aba(s) materializada(s). Pendentes: {len(pendentes)}."
+    )
+
+
+def _executar_importacao(doc, base_folder_path, lista_entidades, modo_importacao, sob_demanda=False):
     """
     Função interna que executa a importação, agora usando as configurações carregadas.
+    Com sob_demanda=True, os pontos ficam em memória e só abas vazias são criadas.
+    Os avisos do parser são publicados na aba de diagnóstico; retorna o coletor.
     """
     # ALTERAÇÃO: Carrega as configurações da planilha
     config = SageConfig(doc)
+    if lista_entidades is not None:
+        # Uma aba agrupada é sempre reimportada inteira (todas as entidades do grupo).
+        lista_entidades = _expandir_grupos(lista_entidades, config)
+    diagnostico = DiagnosticoImportacao()
+    all_data = _coletar_dados_base(base_folder_path, lista_entidades, diagnostico)
+
+    # Lógica de escrita na planilha (abas ordenadas pela configuração)
+    entidades = [e for e in lista_entidades if e in all_data] if lista_entidades is not None else list(all_data)
+    estado = _estado_documento(doc)
+    if sob_demanda:
+        estado['config'] = config
+    removidas = _remover_abas_substituidas(doc, config, lista_entidades)
+    if removidas:
+        _log_importacao('INFO', f"Abas substituídas pelos grupos atuais removidas: {', '.join(removidas)}.")
+    for sheet_name, membros in _planejar_abas(entidades, config):
+        pontos = _pontos_da_aba(all_data, membros)
+        if pontos:
+            if sob_demanda:
+                _criar_aba_pendente(doc, sheet_name, pontos, config)
+                continue
+            estado['pendentes'].pop(sheet_name, None)
+            # Passa o objeto de configuração para a função de escrita
+            write_to_sheet(doc, sheet_name, pontos, modo_importacao, config)
+    if sob_demanda:
+        _registrar_materializacao_ao_ativar(doc)
+    diagnostico.publicar(doc)
+    _log_importacao('INFO', f"{diagnostico.resumo()}.")
+    return diagnostico
+
+
+def _coletar_dados_base(base_folder_path, lista_entidades=None, diagnostico=None):
+    """Varre a pasta da base e faz o parse de todos os .dat, retornando {entidade: [pontos]}."""
     all_data = {}
-    prioridade_entidades = {entidade: idx for idx, entidade in enumerate(config.ordem_entidades)}
-    
-    # (A lógica de varrer os arquivos permanece a mesma)
     for root, _, files in os.walk(base_folder_path):
         entidades_validas_set = {os.path.splitext(f)[0].upper() for f in files if f.lower().endswith('.dat')}
         for file_name in files:
@@ -374,22 +719,279 @@ def _executar_importacao(doc, base_folder_path, lista_entidades, modo_importacao
                 continue
             full_path = os.path.join(root, file_name)
             relative_path = os.path.relpath(full_path, base_folder_path)
-            parse_dat_file(full_path, relative_path, all_data, entidades_validas_set)
+            parse_dat_file(full_path, relative_path, all_data, entidades_validas_set, diagnostico)
+    return all_data
 
-    # ALTERAÇÃO: Ordena as entidades a serem escritas com base na configuração
-    entidades_importadas = all_data.keys()
-    abas_ordenadas = sorted(
-        entidades_importadas,
-        key=lambda e: prioridade_entidades.get(e, float('inf'))
+
+def _remover_abas_substituidas(doc, config, lista_entidades=None):
+    """
+    Remove as abas que a configuração de grupos tornou obsoletas: a aba própria de uma
+    entidade que agora pertence a um grupo e a aba de um grupo que saiu da 'MaisUsadas'.
+    Se ficassem, a exportação gravaria os mesmos blocos duas vezes. Na importação parcial,
+    só são removidas abas cujas entidades estão todas sendo reimportadas.
+    """
+    estado = _estado_documento(doc)
+    sheets = doc.getSheets()
+    removidas = []
+    for sheet in _abas_de_entidades(doc):
+        sheet_name = sheet.getName()
+        nome = sheet_name.lower()
+        if nome in config.grupos_entidades:
+            continue
+        if config.aba_da_entidade(nome) != nome:
+            membros = {nome}
+        else:
+            membros = _entidades_da_folha(doc, sheet)
+            if not membros or membros == {nome}:
+                continue
+        if lista_entidades is not None and not membros.issubset(lista_entidades):
+            continue
+        sheets.removeByName(sheet_name)
+        estado['pendentes'].pop(sheet_name, None)
+        estado['rastreadas'].pop(sheet_name, None)
+        estado['alteradas'].discard(sheet_name)
+        removidas.append(sheet_name)
+    return removidas
+
+
+def _entidades_da_folha(doc, sheet):
+    """Entidades da coluna 'Entidade' da aba (ou dos pontos em memória, se pendente); None se não houver a coluna."""
+    pontos = _estado_documento(doc)['pendentes'].get(sheet.getName())
+    if pontos is not None:
+        return {str(ponto.get('entidade', '')).lower() for ponto in pontos} - {''}
+    cursor = sheet.createCursor()
+    cursor.gotoEndOfUsedArea(False)
+    data_range = cursor.getRangeAddress()
+    headers = sheet.getCellRangeByPosition(0, 0, data_range.EndColumn, 0).getDataArray()[0]
+    if CABEÇALHO_COLUNA_ENTIDADE not in headers:
+        return None
+    if data_range.EndRow < 1:
+        return set()
+    col_idx = headers.index(CABEÇALHO_COLUNA_ENTIDADE)
+    coluna = sheet.getCellRangeByPosition(col_idx, 1, col_idx, data_range.EndRow).getDataArray()
+    return {str(row[0]).strip().lower() for row in coluna} - {''}
+
+
+def _expandir_grupos(nomes, config):
+    """Troca cada entidade (ou nome de grupo) pela lista completa de entidades da sua aba."""
+    expandidas = []
+    for nome in nomes:
+        for entidade_nome in config.entidades_da_aba(config.aba_da_entidade(nome)):
+            if entidade_nome not in expandidas:
+                expandidas.append(entidade_nome)
+    return expandidas
+
+
+def _planejar_abas(entidades, config):
+    """
+    Distribui as entidades nas abas (uma por entidade ou uma por grupo) e retorna
+    [(aba, [entidades])] na ordem definida pela aba 'MaisUsadas'.
+    """
+    abas = {}
+    for entidade_nome in entidades:
+        abas.setdefault(config.aba_da_entidade(entidade_nome), []).append(entidade_nome)
+    for sheet_name, membros in abas.items():
+        ordem_grupo = config.grupos_entidades.get(sheet_name)
+        if ordem_grupo:
+            membros.sort(key=ordem_grupo.index)
+    prioridade_entidades = {entidade: idx for idx, entidade in enumerate(config.ordem_entidades)}
+    return sorted(abas.items(), key=lambda item: prioridade_entidades.get(item[0], float('inf')))
+
+
+def _pontos_da_aba(all_data, entidades):
+    """Junta os pontos das entidades da aba, anotando em cada um a entidade de origem."""
+    pontos = []
+    for entidade_nome in entidades:
+        for ponto in all_data.get(entidade_nome, []):
+            ponto['entidade'] = entidade_nome
+            pontos.append(ponto)
+    return pontos
+
+
+def _montar_matriz_pontos(sheet_name, pontos_importados, config):
+    """
+    Monta a matriz (cabeçalho + linhas) de uma aba no mesmo formato das planilhas,
+    ordenando os atributos pela configuração da aba 'MaisUsadas' (se houver).
+    Abas agrupadas ganham a coluna 'Entidade' e a união dos atributos dos membros.
+    """
+    membros = config.grupos_entidades.get(sheet_name.lower()) if config else None
+    # Ordem de primeira ocorrência (não a de um set), para que a mesma base gere sempre as mesmas colunas.
+    todos_atributos = dict.fromkeys(attr for p in pontos_importados if 'attributes' in p for attr in p['attributes'])
+    if membros:
+        ordem_atributos_aba = []
+        for entidade_nome in membros:
+            ordem_atributos_aba.extend(
+                a for a in config.ordem_atributos.get(entidade_nome, []) if a not in ordem_atributos_aba
+            )
+    else:
+        ordem_atributos_aba = config.ordem_atributos.get(sheet_name.lower(), []) if config else []
+    prioridade_atributos = {attr: idx for idx, attr in enumerate(ordem_atributos_aba)}
+    atributos_ordenados = sorted(
+        list(todos_atributos),
+        key=lambda a: prioridade_atributos.get(a, float('inf'))
     )
+    cabecalhos = [CABEÇALHO_COLUNA_ORIGEM, CABEÇALHO_COLUNA_CONTROLE, CABEÇALHO_COLUNA_DADOS]
+    if membros:
+        cabecalhos.append(CABEÇALHO_COLUNA_ENTIDADE)
+    cabecalhos.append(CABEÇALHO_COLUNA_POSICAO)
+    posicao_col_idx = len(cabecalhos) - 1
+    cabecalhos += atributos_ordenados
+    header_to_col = {header: idx for idx, header in enumerate(cabecalhos)}
 
-    # Lógica de escrita na planilha
-    abas_a_escrever = lista_entidades if lista_entidades is not None else abas_ordenadas
-    for entidade_nome in abas_a_escrever:
-        pontos = all_data.get(entidade_nome)
-        if pontos:
-            # Passa o objeto de configuração para a função de escrita
-            write_to_sheet(doc, entidade_nome, pontos, modo_importacao, config)
+    data_matrix = [cabecalhos]
+    for ponto in pontos_importados:
+        row_data = [''] * len(cabecalhos)
+        row_data[0] = ponto.get('origem', '')
+        row_data[1] = ponto['type']
+        if ponto['type'] in [CODIGO_COMENTARIO_SIMPLES, CODIGO_INCLUDE, CODIGO_INCLUDE_COMENTADO]:
+            row_data[2] = ponto.get('data', '')
+        elif ponto['type'] in [CODIGO_BLOCO_ATIVO, CODIGO_BLOCO_COMENTADO]:
+            row_data[2] = ponto.get('comment', '')
+        if membros:
+            row_data[3] = ponto.get('entidade', '')
+        row_data[posicao_col_idx] = ponto.get('posicao', '')
+        if 'attributes' in ponto:
+            for attr_key, attr_value in ponto['attributes'].items():
+                col_idx = header_to_col.get(attr_key)
+                if col_idx is not None:
+                    row_data[col_idx] = attr_value
+        data_matrix.append(row_data)
+    return data_matrix
+
+
+# ===============================================================
+# ============ ARMAZENAMENTO EM MEMÓRIA (SOB DEMANDA) ===========
+# ===============================================================
+
+# Estado por documento, válido durante a sessão do LibreOffice:
+# {'pendentes': {aba: [pontos]}, 'config': SageConfig, 'listener': listener de ativação,
+#  'rastreadas': {aba: listener de alterações}, 'alteradas': {abas editadas desde a última importação/exportação}}
+_ESTADO_DOCUMENTOS = {}
+
+
+def _chave_documento(doc):
+    try:
+        return doc.RuntimeUID
+    except Exception:
+        return id(doc)
+
+
+def _estado_documento(doc):
+    return _ESTADO_DOCUMENTOS.setdefault(
+        _chave_documento(doc),
+        {'pendentes': {}, 'config': None, 'listener': None, 'rastreadas': {}, 'alteradas': set(), 'destaques': {}}
+    )
+
+
+def _criar_aba_pendente(doc, sheet_name, pontos, config):
+    """Cria uma aba vazia (só cor e marcador) e guarda os pontos em memória."""
+    sheets = doc.getSheets()
+    if sheets.hasByName(sheet_name):
+        sheets.removeByName(sheet_name)
+    _estado_documento(doc)['rastreadas'].pop(sheet_name, None)
+    sheets.insertNewByName(sheet_name, sheets.getCount())
+    sheet = sheets.getByName(sheet_name)
+    cor_aba = config.cores_entidades.get(sheet_name.lower())
+    if cor_aba is not None and cor_aba != -1:
+        sheet.TabColor = cor_aba
+    sheet.getCellByPosition(0, 0).setString(MARCADOR_ABA_PENDENTE)
+    _estado_documento(doc)['pendentes'][sheet_name] = pontos
+
+
+def _materializar_aba(doc, sheet_name):
+    """Escreve na aba os pontos que estavam apenas em memória."""
+    estado = _estado_documento(doc)
+    pontos = estado['pendentes'].pop(sheet_name, None)
+    if pontos is None:
+        return False
+    config = estado['config'] or SageConfig(doc)
+    write_to_sheet(doc, sheet_name, pontos, 'UPDATE', config)
+    return True
+
+
+def _ler_dados_para_exportacao(doc, sheet, extracao=None):
+    """
+    Lê os dados da aba; abas não materializadas usam diretamente os pontos em memória.
+    Com uma _ExtracaoAbas, as demais abas vêm da extração pelo filtro CSV.
+    """
+    estado = _estado_documento(doc)
+    pontos = estado['pendentes'].get(sheet.getName())
+    if pontos is not None:
+        return _montar_matriz_pontos(sheet.getName(), pontos, estado['config'])
+    if extracao is not None:
+        return extracao.ler(sheet)
+    return _ler_dados_folha(sheet)
+
+
+if unohelper is not None:
+    class _MaterializadorAoAtivar(unohelper.Base, XActivationEventListener):
+        """Materializa a aba pendente assim que o usuário a ativa."""
+        def __init__(self, doc):
+            self.doc = doc
+
+        def activeSpreadsheetChanged(self, event):
+            try:
+                _materializar_aba(self.doc, event.ActiveSheet.getName())
+            except Exception as e:
+                print(f"ERRO ao materializar a aba: {e}")
+
+        def disposing(self, source):
+            _ESTADO_DOCUMENTOS.pop(_chave_documento(self.doc), None)
+
+
+if unohelper is not None:
+    class _RastreadorAlteracoes(unohelper.Base, XModifyListener):
+        """Marca a aba como alterada desde a última importação/exportação."""
+        def __init__(self, doc):
+            self.doc = doc
+
+        def modified(self, event):
+            try:
+                _estado_documento(self.doc)['alteradas'].add(event.Source.getName())
+            except Exception:
+                pass
+
+        def disposing(self, source):
+            pass
+
+
+def _rastrear_aba(doc, sheet, recriada=False):
+    """Registra (uma vez por aba) o listener de alterações e marca a aba como não alterada."""
+    estado = _estado_documento(doc)
+    sheet_name = sheet.getName()
+    if recriada:
+        estado['rastreadas'].pop(sheet_name, None)
+    if unohelper is not None and sheet_name not in estado['rastreadas']:
+        try:
+            listener = _RastreadorAlteracoes(doc)
+            sheet.addModifyListener(listener)
+            estado['rastreadas'][sheet_name] = listener
+        except Exception as e:
+            print(f"AVISO: Não foi possível rastrear alterações da aba '{sheet_name}'. {e}")
+    estado['alteradas'].discard(sheet_name)
+
+
+def _aba_alterada(doc, sheet_name):
+    """
+    Indica se a aba precisa ser exportada no modo "somente alteradas". Abas sem rastreamento
+    nesta sessão (ex.: documento reaberto) contam como alteradas; abas não materializadas, não.
+    """
+    estado = _estado_documento(doc)
+    if sheet_name in estado['pendentes']:
+        return False
+    return sheet_name in estado['alteradas'] or sheet_name not in estado['rastreadas']
+
+
+def _registrar_materializacao_ao_ativar(doc):
+    estado = _estado_documento(doc)
+    if unohelper is None or estado['listener'] is not None:
+        return
+    try:
+        listener = _MaterializadorAoAtivar(doc)
+        doc.getCurrentController().addActivationEventListener(listener)
+        estado['listener'] = listener
+    except Exception as e:
+        print(f"AVISO: Não foi possível registrar a materialização automática. Use a macro materializar_abas. {e}")
 
 
 def write_to_sheet(doc, sheet_name, pontos_importados, modo, config):
@@ -398,6 +1000,7 @@ def write_to_sheet(doc, sheet_name, pontos_importados, modo, config):
     incluindo o efeito zebrado nas linhas importadas + 20 linhas extras.
     """
     # --- Bloco de Limpeza e Criação de Aba (sem alterações) ---
+    aba_recriada = False
     if modo == 'UPDATE' and doc.getSheets().hasByName(sheet_name):
         sheet = doc.getSheets().getByName(sheet_name)
         cursor = sheet.createCursor()
@@ -410,37 +1013,16 @@ def write_to_sheet(doc, sheet_name, pontos_importados, modo, config):
         new_sheet = doc.createInstance("com.sun.star.sheet.Spreadsheet")
         doc.getSheets().insertByName(sheet_name, new_sheet)
         sheet = doc.getSheets().getByName(sheet_name)
+        aba_recriada = True
 
     # --- Aplicação de Cores de Aba e Ordenação de Colunas (sem alterações) ---
     cor_aba = config.cores_entidades.get(sheet_name.lower())
     if cor_aba is not None and cor_aba != -1:
         sheet.TabColor = cor_aba
-    todos_atributos = {attr for p in pontos_importados if 'attributes' in p for attr in p['attributes']}
-    ordem_atributos_aba = config.ordem_atributos.get(sheet_name.lower(), [])
-    prioridade_atributos = {attr: idx for idx, attr in enumerate(ordem_atributos_aba)}
-    atributos_ordenados = sorted(
-        list(todos_atributos),
-        key=lambda a: prioridade_atributos.get(a, float('inf'))
-    )
-    cabecalhos = [CABEÇALHO_COLUNA_ORIGEM, CABEÇALHO_COLUNA_CONTROLE, CABEÇALHO_COLUNA_DADOS] + atributos_ordenados
-    header_to_col = {header: idx for idx, header in enumerate(cabecalhos)}
-    
+
     # --- Preenchimento dos Dados (agora em lote para reduzir chamadas UNO) ---
-    data_matrix = [cabecalhos]
-    for ponto in pontos_importados:
-        row_data = [''] * len(cabecalhos)
-        row_data[0] = ponto.get('origem', '')
-        row_data[1] = ponto['type']
-        if ponto['type'] in [CODIGO_COMENTARIO_SIMPLES, CODIGO_INCLUDE, CODIGO_INCLUDE_COMENTADO]:
-            row_data[2] = ponto.get('data', '')
-        elif ponto['type'] in [CODIGO_BLOCO_ATIVO, CODIGO_BLOCO_COMENTADO]:
-            row_data[2] = ponto.get('comment', '')
-        if 'attributes' in ponto:
-            for attr_key, attr_value in ponto['attributes'].items():
-                col_idx = header_to_col.get(attr_key)
-                if col_idx is not None:
-                    row_data[col_idx] = attr_value
-        data_matrix.append(row_data)
+    data_matrix = _montar_matriz_pontos(sheet_name, pontos_importados, config)
+    cabecalhos = data_matrix[0]
 
     if data_matrix:
         num_rows = len(data_matrix) - 1
@@ -483,12 +1065,20 @@ def write_to_sheet(doc, sheet_name, pontos_importados, modo, config):
             row_range = sheet.getCellRangeByPosition(0, r, last_col, r)
             row_range.CellBackColor = cor_a_aplicar
 
-    # O BLOCO DE CÓDIGO PARA VALIDAÇÃO DE DADOS FOI COMPLETAMENTE REMOVIDO
+    # A validação de dados não é mais feita por célula (objetos de validação do Calc);
+    # ela roda em lote antes da exportação (ver _validar_dados_folha).
+
+    # A aba acabou de ser escrita a partir dos .dat: passa a ser rastreada como não alterada.
+    _rastrear_aba(doc, sheet, recriada=aba_recriada)
 
 # ===============================================================
 # =================== LÓGICA DE PARSING =========================
 # ===============================================================
-def parse_dat_file(file_path, relative_path, all_data, entidades_validas):
+def parse_dat_file(file_path, relative_path, all_data, entidades_validas, diagnostico=None):
+    """
+    Faz o parse de um .dat acrescentando os pontos em all_data. Os avisos vão para o
+    coletor 'diagnostico' (DiagnosticoImportacao) ou, sem ele, direto ao log.
+    """
     start_time = time.perf_counter()
     lines = None
     for encoding in ENCODINGS_IMPORTACAO_SAGE:
@@ -499,7 +1089,7 @@ def parse_dat_file(file_path, relative_path, all_data, entidades_validas):
         except UnicodeDecodeError:
             continue
         except IOError as e:
-            print(f"Erro ao ler o arquivo {file_path}: {e}")
+            _avisar_importacao(diagnostico, relative_path, 0, 'ERRO_LEITURA', f"erro ao ler o arquivo: {e}", str(e))
             return
 
     if lines is None:
@@ -508,7 +1098,7 @@ def parse_dat_file(file_path, relative_path, all_data, entidades_validas):
             with open(file_path, 'r', encoding=ENCODING_EXPORTACAO_SAGE, errors='ignore') as f:
                 lines = f.readlines()
         except IOError as e:
-            print(f"Erro ao ler o arquivo {file_path}: {e}")
+            _avisar_importacao(diagnostico, relative_path, 0, 'ERRO_LEITURA', f"erro ao ler o arquivo: {e}", str(e))
             return
         
     i = 0
@@ -518,6 +1108,7 @@ def parse_dat_file(file_path, relative_path, all_data, entidades_validas):
     stats = {
         'lines_total': len(lines),
         'entities_imported': 0,
+        'points': 0,
         'comments': 0,
         'ignored_lines': 0,
         'invalid_lines': 0,
@@ -554,7 +1145,7 @@ def parse_dat_file(file_path, relative_path, all_data, entidades_validas):
 
         if current_block:
             if line_info['type'] in ['entity_start', 'commented_entity_start', 'include', 'include_commented', 'block_end']:
-                _finalizar_bloco(current_block, all_data, relative_path, stats, line_no)
+                _finalizar_bloco(current_block, all_data, relative_path, stats, line_no, diagnostico)
                 current_block = None
                 continue
 
@@ -576,10 +1167,10 @@ def parse_dat_file(file_path, relative_path, all_data, entidades_validas):
 
             stats['invalid_lines'] += 1
             stats['warnings'] += 1
-            _log_importacao(
-                'WARN',
-                f"{relative_path}:{line_no} linha inválida dentro do bloco {current_block['identifier']}: {line_info['original']}",
-                force=True
+            _avisar_importacao(
+                diagnostico, relative_path, line_no, 'LINHA_INVALIDA_NO_BLOCO',
+                f"linha inválida dentro do bloco {current_block['identifier']}: {line_info['original']}",
+                line_info['original']
             )
             i += 1
             continue
@@ -590,28 +1181,28 @@ def parse_dat_file(file_path, relative_path, all_data, entidades_validas):
             continue
 
         if line_info['type'] == 'include_commented':
-            ponto = {'type': CODIGO_INCLUDE_COMENTADO, 'data': line_info['value'], 'origem': relative_path}
+            ponto = {'type': CODIGO_INCLUDE_COMENTADO, 'data': line_info['value'], 'origem': relative_path, 'posicao': stats['points']}
+            stats['points'] += 1
             all_data.setdefault(current_entidade_chave, []).append(ponto)
             if pending_comments:
                 stats['warnings'] += 1
-                _log_importacao(
-                    'WARN',
-                    f"{relative_path}:{line_no} comentários pendentes descartados antes de include comentado.",
-                    force=True
+                _avisar_importacao(
+                    diagnostico, relative_path, line_no, 'COMENTARIOS_DESCARTADOS',
+                    "comentários pendentes descartados antes de include comentado.", line_info['original']
                 )
                 pending_comments = []
             i += 1
             continue
 
         if line_info['type'] == 'include':
-            ponto = {'type': CODIGO_INCLUDE, 'data': line_info['value'], 'origem': relative_path}
+            ponto = {'type': CODIGO_INCLUDE, 'data': line_info['value'], 'origem': relative_path, 'posicao': stats['points']}
+            stats['points'] += 1
             all_data.setdefault(current_entidade_chave, []).append(ponto)
             if pending_comments:
                 stats['warnings'] += 1
-                _log_importacao(
-                    'WARN',
-                    f"{relative_path}:{line_no} comentários pendentes descartados antes de include.",
-                    force=True
+                _avisar_importacao(
+                    diagnostico, relative_path, line_no, 'COMENTARIOS_DESCARTADOS',
+                    "comentários pendentes descartados antes de include.", line_info['original']
                 )
                 pending_comments = []
             i += 1
@@ -652,25 +1243,23 @@ def parse_dat_file(file_path, relative_path, all_data, entidades_validas):
         if line_info['type'] == 'attribute':
             stats['warnings'] += 1
             stats['invalid_lines'] += 1
-            _log_importacao(
-                'WARN',
-                f"{relative_path}:{line_no} atributo fora de bloco ignorado: {line_info['original']}",
-                force=True
+            _avisar_importacao(
+                diagnostico, relative_path, line_no, 'ATRIBUTO_FORA_DE_BLOCO',
+                f"atributo fora de bloco ignorado: {line_info['original']}", line_info['original']
             )
             i += 1
             continue
 
         stats['warnings'] += 1
         stats['invalid_lines'] += 1
-        _log_importacao(
-            'WARN',
-            f"{relative_path}:{line_no} linha não reconhecida ignorada: {line_info['original']}",
-            force=True
+        _avisar_importacao(
+            diagnostico, relative_path, line_no, 'LINHA_NAO_RECONHECIDA',
+            f"linha não reconhecida ignorada: {line_info['original']}", line_info['original']
         )
         i += 1
 
     if current_block:
-        _finalizar_bloco(current_block, all_data, relative_path, stats, len(lines))
+        _finalizar_bloco(current_block, all_data, relative_path, stats, len(lines), diagnostico)
 
     elapsed = time.perf_counter() - start_time
     _log_importacao(
@@ -683,6 +1272,386 @@ def parse_dat_file(file_path, relative_path, all_data, entidades_validas):
         )
     )
 
+# ===============================================================
+# ================ CENSO RÁPIDO DE ENTIDADES ====================
+# ===============================================================
+
+def censo_dats(*args):
+    """
+    Conta blocos ativos/comentados e includes de cada .dat da pasta de importação
+    sem fazer o parse completo, e grava o resultado na aba 'Censo'.
+    """
+    doc = XSCRIPTCONTEXT.getDocument() # type: ignore
+    geral_sheet = doc.getSheets().getByName(NOME_ABA_GERAL)
+    status_cell = geral_sheet.getCellByPosition(*CELULA_STATUS_IMPORTACAO)
+    folder_path = geral_sheet.getCellByPosition(*CELULA_CAMINHO_IMPORTACAO).getString()
+    if not os.path.isdir(folder_path):
+        status_cell.setString("ERRO: O caminho especificado não é uma pasta válida.")
+        return
+
+    start_time = time.perf_counter()
+    censo = censo_base(folder_path)
+    elapsed = time.perf_counter() - start_time
+    _publicar_censo(doc, censo)
+
+    total_blocos = sum(c['ativos'] + c['comentados'] for arq in censo.values() for c in arq['entidades'].values())
+    status_cell.setString(f"Censo concluído em {elapsed:.3f}s: {total_blocos} blocos em {len(censo)} arquivo(s).")
+
+
+def censo_base(base_folder_path):
+    """
+    Executa o censo de todos os .dat da base. Retorna {caminho_relativo: censo_do_arquivo},
+    usando as mesmas entidades válidas (nomes dos .dat da pasta) da importação.
+    """
+    censo = {}
+    for root, _, files in os.walk(base_folder_path):
+        entidades_validas = {os.path.splitext(f)[0].upper().encode('latin-1') for f in files if f.lower().endswith('.dat')}
+        for file_name in files:
+            if not file_name.lower().endswith('.dat'):
+                continue
+            full_path = os.path.join(root, file_name)
+            relative_path = os.path.relpath(full_path, base_folder_path)
+            try:
+                censo[relative_path] = _censo_arquivo_dat(full_path, entidades_validas)
+            except (IOError, ValueError) as e:
+                print(f"Erro ao ler o arquivo {full_path}: {e}")
+    return censo
+
+
+def _censo_arquivo_dat(file_path, entidades_validas):
+    """
+    Varre o arquivo mapeado em memória procurando, direto nos bytes, inícios de linha com
+    nomes de entidade (ativos ou ';ENTIDADE') e includes. Não decodifica o arquivo nem monta
+    pontos; latin-1 e utf-8 são seguros porque os padrões procurados são ASCII.
+    """
+    censo = {'entidades': {}, 'includes': 0, 'includes_comentados': 0}
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return censo
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            for match in REGEX_CENSO_INICIO_BLOCO.finditer(buffer):
+                nome = match.group(2).upper()
+                if nome not in entidades_validas:
+                    continue
+                contagem = censo['entidades'].setdefault(nome.decode('latin-1').lower(), {'ativos': 0, 'comentados': 0})
+                contagem['comentados' if match.group(1) else 'ativos'] += 1
+            for match in REGEX_CENSO_INCLUDE.finditer(buffer):
+                censo['includes_comentados' if match.group(1) else 'includes'] += 1
+    return censo
+
+
+def _publicar_censo(doc, censo):
+    """Recria a aba de censo com um único setDataArray (uma linha por arquivo/entidade)."""
+    sheets = doc.getSheets()
+    if sheets.hasByName(NOME_ABA_CENSO):
+        sheets.removeByName(NOME_ABA_CENSO)
+    sheets.insertNewByName(NOME_ABA_CENSO, sheets.getCount())
+    sheet = sheets.getByName(NOME_ABA_CENSO)
+
+    data_matrix = [("Arquivo", "Entidade", "Ativos", "Comentados", "Includes", "Includes Comentados")]
+    totais = {}
+    for relative_path in sorted(censo):
+        arquivo = censo[relative_path]
+        data_matrix.append((relative_path, "", "", "", arquivo['includes'], arquivo['includes_comentados']))
+        for entidade_nome in sorted(arquivo['entidades']):
+            contagem = arquivo['entidades'][entidade_nome]
+            data_matrix.append((relative_path, entidade_nome, contagem['ativos'], contagem['comentados'], "", ""))
+            total = totais.setdefault(entidade_nome, [0, 0])
+            total[0] += contagem['ativos']
+            total[1] += contagem['comentados']
+    for entidade_nome in sorted(totais):
+        data_matrix.append(("TOTAL", entidade_nome, totais[entidade_nome][0], totais[entidade_nome][1], "", ""))
+    data_matrix.append((
+        "TOTAL", "", sum(t[0] for t in totais.values()), sum(t[1] for t in totais.values()),
+        sum(a['includes'] for a in censo.values()), sum(a['includes_comentados'] for a in censo.values())
+    ))
+    sheet.getCellRangeByPosition(0, 0, len(data_matrix[0]) - 1, len(data_matrix) - 1).setDataArray(tuple(data_matrix))
+    columns = sheet.getColumns()
+    for i in range(len(data_matrix[0])):
+        columns.getByIndex(i).OptimalWidth = True
+
+# ===============================================================
+# ============ MONITORAMENTO DA PASTA DE IMPORTAÇÃO =============
+# ===============================================================
+
+# Constantes do inotify (linux/inotify.h)
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_INOTIFY_MASCARA = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+_INOTIFY_EVENTO = struct.Struct('iIII')
+
+
+def iniciar_monitoramento(*args):
+    """
+    Monitora a pasta de importação e reimporta automaticamente os .dat alterados em disco,
+    atualizando apenas as abas das entidades afetadas (modo UPDATE).
+    """
+    doc = XSCRIPTCONTEXT.getDocument() # type: ignore
+    geral_sheet = doc.getSheets().getByName(NOME_ABA_GERAL)
+    status_cell = geral_sheet.getCellByPosition(*CELULA_STATUS_IMPORTACAO)
+    folder_path = geral_sheet.getCellByPosition(*CELULA_CAMINHO_IMPORTACAO).getString()
+    if not os.path.isdir(folder_path):
+        status_cell.setString("ERRO: O caminho especificado não é uma pasta válida.")
+        return
+
+    estado = _estado_documento(doc)
+    monitor = estado.get('monitor')
+    if monitor is not None and monitor.is_alive():
+        status_cell.setString(f"AVISO: O monitoramento já está ativo em {monitor.base_folder_path}.")
+        return
+
+    monitor = _MonitorBase(doc, folder_path, SageConfig(doc), status_cell)
+    estado['monitor'] = monitor
+    monitor.start()
+    status_cell.setString(f"Monitorando {folder_path} ({monitor.tipo_fonte})...")
+
+
+def parar_monitoramento(*args):
+    doc = XSCRIPTCONTEXT.getDocument() # type: ignore
+    geral_sheet = doc.getSheets().getByName(NOME_ABA_GERAL)
+    monitor = _estado_documento(doc).pop('monitor', None)
+    if monitor is None or not monitor.is_alive():
+        geral_sheet.getCellByPosition(*CELULA_STATUS_IMPORTACAO).setString("AVISO: Nenhum monitoramento ativo.")
+        return
+    monitor.parar()
+    geral_sheet.getCellByPosition(*CELULA_STATUS_IMPORTACAO).setString("Monitoramento encerrado.")
+
+
+class _FonteInotify:
+    """Fonte de eventos via inotify (Linux), acessado por ctypes; observa a árvore inteira."""
+    # O select acorda assim que há eventos; o limite só define a frequência da checagem do debounce.
+    intervalo_espera = MONITOR_DEBOUNCE_SEGUNDOS
+
+    def __init__(self, base_folder_path):
+        self.base_folder_path = base_folder_path
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 falhou")
+        self.pastas_por_wd = {}
+        for root, _, _ in os.walk(base_folder_path):
+            self._observar(root)
+
+    def _observar(self, pasta):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(pasta), _INOTIFY_MASCARA)
+        if wd >= 0:
+            self.pastas_por_wd[wd] = pasta
+
+    def aguardar(self, timeout):
+        """Retorna o conjunto de caminhos .dat alterados (vazio se nada ocorreu no timeout)."""
+        prontos, _, _ = select.select([self.fd], [], [], timeout)
+        if not prontos:
+            return set()
+        try:
+            buffer = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return set()
+
+        alterados = set()
+        offset = 0
+        while offset + _INOTIFY_EVENTO.size <= len(buffer):
+            wd, mask, _, name_len = _INOTIFY_EVENTO.unpack_from(buffer, offset)
+            offset += _INOTIFY_EVENTO.size
+            nome = os.fsdecode(buffer[offset:offset + name_len].rstrip(b'\0'))
+            offset += name_len
+            if mask & _IN_Q_OVERFLOW:
+                # Fila estourou: considera todos os .dat da base alterados.
+                return _listar_arquivos_dat(self.base_folder_path)
+            pasta = self.pastas_por_wd.get(wd)
+            if pasta is None or not nome:
+                continue
+            full_path = os.path.join(pasta, nome)
+            if mask & _IN_ISDIR:
+                if mask & (_IN_CREATE | _IN_MOVED_TO):
+                    self._observar(full_path)
+                    alterados.update(_listar_arquivos_dat(full_path))
+                continue
+            if nome.lower().endswith('.dat'):
+                alterados.add(full_path)
+        return alterados
+
+    def fechar(self):
+        os.close(self.fd)
+
+
+class _FontePolling:
+    """Fonte de eventos por varredura periódica de mtime/tamanho (fallback portátil)."""
+    # Cada espera custa uma varredura completa da árvore, então segue o intervalo configurado.
+    intervalo_espera = MONITOR_INTERVALO_POLLING
+
+    def __init__(self, base_folder_path):
+        self.base_folder_path = base_folder_path
+        self.assinaturas = self._varrer()
+
+    def _varrer(self):
+        assinaturas = {}
+        for full_path in _listar_arquivos_dat(self.base_folder_path):
+            try:
+                info = os.stat(full_path)
+                assinaturas[full_path] = (info.st_mtime_ns, info.st_size)
+            except OSError:
+                continue
+        return assinaturas
+
+    def aguardar(self, timeout):
+        time.sleep(timeout)
+        atuais = self._varrer()
+        alterados = {p for p, assinatura in atuais.items() if self.assinaturas.get(p) != assinatura}
+        alterados.update(p for p in self.assinaturas if p not in atuais)
+        self.assinaturas = atuais
+        return alterados
+
+    def fechar(self):
+        pass
+
+
+def _listar_arquivos_dat(folder_path):
+    return {
+        os.path.join(root, f)
+        for root, _, files in os.walk(folder_path)
+        for f in files if f.lower().endswith('.dat')
+    }
+
+
+def _criar_fonte_eventos(base_folder_path):
+    if sys.platform.startswith('linux'):
+        try:
+            return _FonteInotify(base_folder_path)
+        except (OSError, AttributeError) as e:
+            print(f"AVISO: inotify indisponível, usando varredura periódica. {e}")
+    return _FontePolling(base_folder_path)
+
+
+class _MonitorBase(threading.Thread):
+    """
+    Thread que observa a base fora da thread da interface. Agrupa rajadas de alterações
+    (debounce), refaz o parse só dos arquivos tocados e atualiza as abas afetadas em um
+    único bloco de escrita UNO (controladores travados durante a atualização).
+    """
+    def __init__(self, doc, base_folder_path, config, status_cell):
+        super().__init__(name="SageBonisMonitor", daemon=True)
+        self.doc = doc
+        self.base_folder_path = base_folder_path
+        self.config = config
+        self.status_cell = status_cell
+        self.fonte = _criar_fonte_eventos(base_folder_path)
+        self.tipo_fonte = 'inotify' if isinstance(self.fonte, _FonteInotify) else 'varredura'
+        self._evento_parar = threading.Event()
+        # {entidade: {origem: [pontos]}} preserva a posição de cada arquivo dentro da aba.
+        self.pontos_por_origem = {}
+        # Avisos de toda a base; os de cada arquivo são refeitos quando ele é reimportado.
+        self.diagnostico = DiagnosticoImportacao()
+
+    def parar(self):
+        self._evento_parar.set()
+
+    def run(self):
+        try:
+            self._carregar_estado_inicial()
+            pendentes = set()
+            ultimo_evento = 0.0
+            while not self._evento_parar.is_set():
+                alterados = self.fonte.aguardar(self.fonte.intervalo_espera)
+                if alterados:
+                    pendentes.update(alterados)
+                    ultimo_evento = time.monotonic()
+                    continue
+                if pendentes and time.monotonic() - ultimo_evento >= MONITOR_DEBOUNCE_SEGUNDOS:
+                    try:
+                        self._reimportar(pendentes)
+                    except Exception as e:
+                        print(f"ERRO ao reimportar {len(pendentes)} arquivo(s) de {self.base_folder_path}: {e}")
+                    pendentes = set()
+        except Exception as e:
+            print(f"ERRO no monitoramento de {self.base_folder_path}: {e}")
+        finally:
+            self.fonte.fechar()
+
+    def _carregar_estado_inicial(self):
+        for entidade_nome, pontos in _coletar_dados_base(self.base_folder_path, diagnostico=self.diagnostico).items():
+            por_origem = self.pontos_por_origem.setdefault(entidade_nome, {})
+            for ponto in pontos:
+                por_origem.setdefault(ponto.get('origem', ''), []).append(ponto)
+
+    def _reimportar(self, caminhos):
+        relativos = {os.path.relpath(p, self.base_folder_path) for p in caminhos}
+        novos = {}
+        self.diagnostico.descartar_arquivos(relativos)
+        for relative_path in sorted(relativos):
+            full_path = os.path.join(self.base_folder_path, relative_path)
+            if not os.path.isfile(full_path):
+                continue
+            pasta = os.path.dirname(full_path)
+            entidades_validas = {os.path.splitext(f)[0].upper() for f in os.listdir(pasta) if f.lower().endswith('.dat')}
+            parse_dat_file(full_path, relative_path, novos, entidades_validas, self.diagnostico)
+
+        novos_por_origem = {}
+        for entidade_nome, pontos in novos.items():
+            for ponto in pontos:
+                novos_por_origem.setdefault(entidade_nome, {}).setdefault(ponto['origem'], []).append(ponto)
+
+        afetadas = []
+        for entidade_nome in list(self.pontos_por_origem) + [e for e in novos_por_origem if e not in self.pontos_por_origem]:
+            por_origem = self.pontos_por_origem.setdefault(entidade_nome, {})
+            novos_entidade = novos_por_origem.get(entidade_nome, {})
+            alterou = False
+            for relative_path in relativos:
+                if relative_path in novos_entidade:
+                    por_origem[relative_path] = novos_entidade[relative_path]
+                    alterou = True
+                elif por_origem.pop(relative_path, None) is not None:
+                    alterou = True
+            if alterou:
+                afetadas.append(entidade_nome)
+
+        if afetadas:
+            self._atualizar_abas(afetadas)
+
+    def _atualizar_abas(self, entidades):
+        estado = _estado_documento(self.doc)
+        pendentes = estado['pendentes']
+        # Abas com edições ainda não exportadas não são sobrescritas; só são informadas.
+        # Abas não rastreadas nesta sessão (ex.: documento reaberto) contam como alteradas.
+        atualizadas = []
+        preservadas = []
+        sheets = self.doc.getSheets()
+        self.doc.lockControllers()
+        try:
+            for sheet_name, _ in _planejar_abas(entidades, self.config):
+                if sheets.hasByName(sheet_name) and _aba_alterada(self.doc, sheet_name):
+                    preservadas.append(sheet_name)
+                    continue
+                membros = self.config.entidades_da_aba(sheet_name)
+                dados_membros = {
+                    entidade_nome: [p for lista in self.pontos_por_origem.get(entidade_nome, {}).values() for p in lista]
+                    for entidade_nome in membros
+                }
+                pontos = _pontos_da_aba(dados_membros, membros)
+                atualizadas.append(sheet_name)
+                if sheet_name in pendentes:
+                    # Aba ainda não materializada: basta trocar os dados em memória.
+                    pendentes[sheet_name] = pontos
+                    continue
+                write_to_sheet(self.doc, sheet_name, pontos, 'UPDATE', self.config)
+            self.diagnostico.publicar(self.doc)
+            mensagem = f"Monitor: {', '.join(atualizadas) or 'nenhuma aba'} atualizada(s) às {time.strftime('%H:%M:%S')}."
+            if preservadas:
+                mensagem += (
+                    f" AVISO: {', '.join(preservadas)} com edições não exportadas; não foram atualizadas "
+                    "(exporte ou reimporte essas abas)."
+                )
+            self.status_cell.setString(mensagem + _sufixo_diagnostico(self.diagnostico))
+        finally:
+            self.doc.unlockControllers()
+
 # ===============================================================
 # ================= FUNÇÕES DE EXPORTAÇÃO =======================
 # ===============================================================
@@ -702,14 +1671,16 @@ def exportar_dats(*args):
         return
 
     geral_sheet.getCellByPosition(*CELULA_STATUS_EXPORTACAO).setString("Processando exportação total...")
-    abas_a_exportar = [s for s in doc.getSheets() if s.getName().lower() not in [ign.lower() for ign in FOLHAS_IGNORADAS]]
-    erros = [_exportar_folha(sheet, export_folder) for sheet in abas_a_exportar]
-    erros = [e for e in erros if e]
+    abas_a_exportar = _abas_de_entidades(doc)
+    erros, violacoes, id_backup = _executar_exportacao(doc, abas_a_exportar, export_folder)
     
     if erros:
-        geral_sheet.getCellByPosition(*CELULA_STATUS_EXPORTACAO).setString(f"ERRO: {'; '.join(erros)}")
+        geral_sheet.getCellByPosition(*CELULA_STATUS_EXPORTACAO).setString(f"ERRO: {'; '.join(erros)}" + _sufixo_backup(id_backup))
     else:
-        geral_sheet.getCellByPosition(*CELULA_STATUS_EXPORTACAO).setString("Exportação total concluída com sucesso!")
+        mensagem = "Exportação total concluída com sucesso!"
+        geral_sheet.getCellByPosition(*CELULA_STATUS_EXPORTACAO).setString(
+            mensagem + _sufixo_validacao(violacoes) + _sufixo_backup(id_backup)
+        )
 
 
 def exportar_parcial(*args):
@@ -738,7 +1709,8 @@ def exportar_parcial(*args):
         if not nomes_entidades:
             geral_sheet.getCellByPosition(*CELULA_STATUS_EXPORTACAO).setString("AVISO: Nenhuma entidade listada para exportação parcial.")
             return
-        for nome in nomes_entidades:
+        config = SageConfig(doc)
+        for nome in dict.fromkeys(config.aba_da_entidade(nome) for nome in nomes_entidades):
             if doc.getSheets().hasByName(nome):
                 abas_a_exportar.append(doc.getSheets().getByName(nome))
     else:
@@ -747,27 +1719,589 @@ def exportar_parcial(*args):
             abas_a_exportar.append(active_sheet)
 
     geral_sheet.getCellByPosition(*CELULA_STATUS_EXPORTACAO).setString(f"Processando exportação de: {', '.join(s.getName() for s in abas_a_exportar)}...")
-    erros = [_exportar_folha(sheet, export_folder) for sheet in abas_a_exportar]
-    erros = [e for e in erros if e]
+    erros, violacoes, id_backup = _executar_exportacao(doc, abas_a_exportar, export_folder)
 
     if erros:
-        geral_sheet.getCellByPosition(*CELULA_STATUS_EXPORTACAO).setString(f"ERRO: {'; '.join(erros)}")
+        geral_sheet.getCellByPosition(*CELULA_STATUS_EXPORTACAO).setString(f"ERRO: {'; '.join(erros)}" + _sufixo_backup(id_backup))
     else:
-        geral_sheet.getCellByPosition(*CELULA_STATUS_EXPORTACAO).setString("Exportação parcial concluída com sucesso!")
+        mensagem = "Exportação parcial concluída com sucesso!"
+        geral_sheet.getCellByPosition(*CELULA_STATUS_EXPORTACAO).setString(
+            mensagem + _sufixo_validacao(violacoes) + _sufixo_backup(id_backup)
+        )
 
 
-def _exportar_folha(sheet, export_folder):
+def exportar_alteradas(*args):
     """
-    Exporta uma única aba, criando um backup (.bak) do arquivo anterior
-    antes de salvar a nova versão.
+    Exporta apenas as abas de entidades editadas desde a última importação ou exportação
+    (rastreadas por listeners de alteração). Abas sem rastreamento nesta sessão são exportadas.
     """
-    sheet_name = sheet.getName()
+    doc = XSCRIPTCONTEXT.getDocument() # type: ignore
+    try:
+        geral_sheet = doc.getSheets().getByName(NOME_ABA_GERAL)
+        export_path_cell = geral_sheet.getCellByPosition(*CELULA_CAMINHO_EXPORTACAO)
+        export_folder = export_path_cell.getString()
+        if not os.path.isdir(export_folder):
+            geral_sheet.getCellByPosition(*CELULA_STATUS_EXPORTACAO).setString("ERRO: O caminho de destino não é uma pasta válida.")
+            return
+    except Exception as e:
+        geral_sheet.getCellByPosition(*CELULA_STATUS_EXPORTACAO).setString(f"ERRO: Falha ao ler configurações. {e}") # type: ignore
+        return
+
+    abas_a_exportar = [s for s in _abas_de_entidades(doc) if _aba_alterada(doc, s.getName())]
+    if not abas_a_exportar:
+        geral_sheet.getCellByPosition(*CELULA_STATUS_EXPORTACAO).setString("Nenhuma aba alterada desde a última importação/exportação.")
+        return
+
+    geral_sheet.getCellByPosition(*CELULA_STATUS_EXPORTACAO).setString(f"Processando exportação de: {', '.join(s.getName() for s in abas_a_exportar)}...")
+    erros, violacoes, id_backup = _executar_exportacao(doc, abas_a_exportar, export_folder)
+
+    if erros:
+        geral_sheet.getCellByPosition(*CELULA_STATUS_EXPORTACAO).setString(f"ERRO: {'; '.join(erros)}" + _sufixo_backup(id_backup))
+    else:
+        mensagem = f"Exportação das alteradas concluída com sucesso! ({len(abas_a_exportar)} aba(s))"
+        geral_sheet.getCellByPosition(*CELULA_STATUS_EXPORTACAO).setString(
+            mensagem + _sufixo_validacao(violacoes) + _sufixo_backup(id_backup)
+        )
+
+
+def validar_dados(*args):
+    """Valida todas as abas de entidades contra a aba 'EntidadeAtributoValor', sem exportar."""
+    doc = XSCRIPTCONTEXT.getDocument() # type: ignore
+    geral_sheet = doc.getSheets().getByName(NOME_ABA_GERAL)
+    geral_sheet.getCellByPosition(*CELULA_STATUS_EXPORTACAO).setString("Validando dados...")
+
+    config = SageConfig(doc)
+    violacoes = []
+    with _ExtracaoAbas(doc) as extracao:
+        for sheet in _abas_de_entidades(doc):
+            violacoes.extend(_validar_dados_folha(
+                sheet.getName(), _ler_dados_para_exportacao(doc, sheet, extracao), config.regras_validacao
+            ))
+    _publicar_relatorio_validacao(doc, violacoes, config.regras_validacao)
+
+    if violacoes:
+        geral_sheet.getCellByPosition(*CELULA_STATUS_EXPORTACAO).setString(
+            f"AVISO: {len(violacoes)} valor(es) fora da validação. Veja a aba '{NOME_ABA_RELATORIO_VALIDACAO}'."
+        )
+    else:
+        geral_sheet.getCellByPosition(*CELULA_STATUS_EXPORTACAO).setString("Validação concluída: nenhum valor inválido.")
+
+
+def _abas_de_entidades(doc):
+    """Retorna as abas de entidades (todas as abas menos as auxiliares)."""
+    ignoradas = [ign.lower() for ign in FOLHAS_IGNORADAS]
+    return [s for s in doc.getSheets() if s.getName().lower() not in ignoradas]
+
+
+def _sufixo_validacao(violacoes):
+    if not violacoes:
+        return ""
+    return f" AVISO: {len(violacoes)} valor(es) fora da validação (aba '{NOME_ABA_RELATORIO_VALIDACAO}')."
+
+
+def _sufixo_backup(id_backup):
+    """Informa a execução de backup gerada, que pode ser desfeita por 'restaurar_backup'."""
+    if not id_backup:
+        return ""
+    return f" Backup: {id_backup} (informe em A8 para restaurar esta execução)."
+
+
+def _executar_exportacao(doc, abas_a_exportar, export_folder):
+    """
+    Lê cada aba uma única vez, valida todos os atributos em lote (se habilitado) e
+    reúne os blocos de todas as abas em um único plano por arquivo de origem, de modo
+    que cada arquivo seja escrito (e copiado para backup) uma só vez. Arquivos que recebem
+    linhas de uma aba com erro não são gravados. Retorna (erros, violacoes, id da execução
+    de backup ou None).
+    """
+    config = SageConfig(doc)
+    regras_validacao = config.regras_validacao if VALIDAR_ANTES_EXPORTACAO else {}
+    erros = []
+    violacoes = []
+    plano_exportacao = {}
+    abas_renderizadas = set()
+    abas_com_falha = set()
+    origens_bloqueadas = set()  # None: origens de uma aba com erro desconhecidas (nada é gravado)
+
+    with _ExtracaoAbas(doc, abas_a_exportar) as extracao:
+        for sheet in abas_a_exportar:
+            sheet_name = sheet.getName()
+            data_array = _ler_dados_para_exportacao(doc, sheet, extracao)
+            if data_array and data_array[0] and data_array[0][0] == MARCADOR_ABA_PENDENTE:
+                erros.append(f"Aba '{sheet_name}' não foi materializada e seus dados não estão mais em memória; reimporte a base.")
+                _registrar_falha_aba(sheet_name, data_array, abas_com_falha, origens_bloqueadas)
+                continue
+            if regras_validacao:
+                violacoes.extend(_validar_dados_folha(sheet_name, data_array, regras_validacao))
+            dados_agrupados_por_arquivo, erro = _renderizar_dados_folha(sheet_name, data_array)
+            if erro:
+                erros.append(erro)
+                _registrar_falha_aba(sheet_name, data_array, abas_com_falha, origens_bloqueadas)
+                continue
+            _adicionar_ao_plano(plano_exportacao, dados_agrupados_por_arquivo)
+            abas_renderizadas.add(sheet_name.lower())
+
+        erros.extend(_completar_plano_com_outras_abas(
+            doc, plano_exportacao, abas_renderizadas, abas_com_falha, origens_bloqueadas, extracao
+        ))
+
+    if None in origens_bloqueadas:
+        erros.append("Nenhum arquivo foi gravado: não foi possível identificar os arquivos das abas com erro.")
+        plano_exportacao = {}
+    else:
+        bloqueados = sorted(origens_bloqueadas)
+        for relative_path in bloqueados:
+            plano_exportacao.pop(relative_path, None)
+        if bloqueados:
+            erros.append(f"Arquivos não gravados por terem linhas de abas com erro: {', '.join(bloqueados)}.")
+
+    pastas_originais = [_caminho_importacao(doc), export_folder]
+    conteudo_por_arquivo = _ordenar_plano_exportacao(plano_exportacao, pastas_originais, config.ordem_entidades)
+    erro, id_backup = _escrever_arquivos(conteudo_por_arquivo, export_folder) if conteudo_por_arquivo else (None, None)
+    if erro:
+        erros.append(erro)
+
+    if VALIDAR_ANTES_EXPORTACAO:
+        _publicar_relatorio_validacao(doc, violacoes, regras_validacao)
+
+    # Depois do destaque da validação, para que a pintura não marque as abas como alteradas.
+    if not erro and not origens_bloqueadas:
+        pendentes = _estado_documento(doc)['pendentes']
+        for sheet in abas_a_exportar:
+            if sheet.getName().lower() in abas_renderizadas and sheet.getName() not in pendentes:
+                _rastrear_aba(doc, sheet)
+    return erros, violacoes, id_backup
+
+
+class _ExtracaoAbas:
+    """
+    Fonte dos dados das abas durante uma exportação. No modo 'csv', a primeira leitura grava
+    o documento inteiro pelo filtro CSV do Calc (um arquivo por aba, em pasta temporária) e
+    cada aba passa a ser lida do seu arquivo com o módulo csv, sem converter célula a célula
+    pelo UNO. Se o filtro falhar, ou não gerar o arquivo de uma aba, essa leitura usa
+    getDataArray. Informando 'abas', o modo 'csv' só é usado se elas forem ao menos
+    EXTRACAO_CSV_FRACAO_MINIMA das abas de entidades a ler. Use com 'with' para apagar
+    a pasta temporária.
+    """
+    def __init__(self, doc, abas=None, metodo=EXTRACAO_EXPORTACAO):
+        self.doc = doc
+        self.metodo = metodo if uno is not None else 'uno'
+        if self.metodo == 'csv' and abas is not None and not _extracao_csv_compensa(doc, abas):
+            self.metodo = 'uno'
+        self.falhou = False
+        self._pasta = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._pasta is not None:
+            self._pasta.cleanup()
+            self._pasta = None
+        return False
+
+    def ler(self, sheet):
+        if self.metodo == 'csv' and not self.falhou:
+            if self._pasta is None:
+                self._gravar_csv()
+            if self._pasta is not None:
+                caminho = os.path.join(self._pasta.name, f"{NOME_BASE_EXTRACAO}-{sheet.getName()}.csv")
+                if os.path.isfile(caminho):
+                    return _ler_csv_extraido(caminho)
+        return _ler_dados_folha(sheet)
+
+    def _gravar_csv(self):
+        pasta = tempfile.TemporaryDirectory(prefix="sagebonis_extracao_")
+        try:
+            url = uno.systemPathToFileUrl(os.path.join(pasta.name, NOME_BASE_EXTRACAO + ".csv"))
+            self.doc.storeToURL(url, (
+                _propriedade_uno("FilterName", FILTRO_CSV_EXTRACAO),
+                _propriedade_uno("FilterOptions", OPCOES_FILTRO_CSV_EXTRACAO),
+            ))
+        except Exception as e:
+            print(f"AVISO: extração pelo filtro CSV indisponível ({e}); usando getDataArray.")
+            pasta.cleanup()
+            self.falhou = True
+            return
+        self._pasta = pasta
+
+
+def _extracao_csv_compensa(doc, abas):
+    """Indica se as abas a ler são uma fração grande o bastante das abas de entidades."""
+    pendentes = _estado_documento(doc)['pendentes']
+    a_ler = [sheet for sheet in abas if sheet.getName() not in pendentes]
+    total = [sheet for sheet in _abas_de_entidades(doc) if sheet.getName() not in pendentes]
+    return bool(total) and len(a_ler) >= EXTRACAO_CSV_FRACAO_MINIMA * len(total)
+
+
+def _ler_csv_extraido(caminho):
+    """Lê o CSV de uma aba no mesmo formato do getDataArray (linhas de mesmo tamanho)."""
+    with open(caminho, 'r', encoding='utf-8-sig', newline='') as f:
+        linhas = [tuple(row) for row in csv.reader(f)]
+    largura = max((len(row) for row in linhas), default=0)
+    return tuple(row + ('',) * (largura - len(row)) for row in linhas)
+
+
+def _propriedade_uno(nome, valor):
+    propriedade = uno.createUnoStruct("com.sun.star.beans.PropertyValue")
+    propriedade.Name = nome
+    propriedade.Value = valor
+    return propriedade
+
+
+def benchmark_extracao(*args):
+    """
+    Mede a leitura de todas as abas de entidades por getDataArray e pelo filtro CSV e
+    confere se os dois métodos trazem o mesmo conteúdo. Nada é exportado.
+    """
+    doc = XSCRIPTCONTEXT.getDocument() # type: ignore
+    geral_sheet = doc.getSheets().getByName(NOME_ABA_GERAL)
+    status_cell = geral_sheet.getCellByPosition(*CELULA_STATUS_EXPORTACAO)
+    pendentes = _estado_documento(doc)['pendentes']
+    abas = [sheet for sheet in _abas_de_entidades(doc) if sheet.getName() not in pendentes]
+    status_cell.setString(f"Comparando métodos de extração em {len(abas)} aba(s)...")
+
+    inicio = time.perf_counter()
+    dados_uno = {sheet.getName(): _ler_dados_folha(sheet) for sheet in abas}
+    tempo_uno = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    with _ExtracaoAbas(doc, metodo='csv') as extracao:
+        dados_csv = {sheet.getName(): extracao.ler(sheet) for sheet in abas}
+    tempo_csv = time.perf_counter() - inicio
+
+    diferentes = [
+        nome for nome in dados_uno
+        if _normalizar_matriz_extraida(dados_uno[nome]) != _normalizar_matriz_extraida(dados_csv[nome])
+    ]
+    celulas = sum(len(dados) * len(dados[0]) for dados in dados_uno.values() if dados)
+    mensagem = (
+        f"Extração de {len(abas)} aba(s) ({celulas} células): "
+        f"getDataArray {tempo_uno:.3f}s, filtro CSV {tempo_csv:.3f}s."
+    )
+    if extracao.falhou:
+        mensagem += " AVISO: filtro CSV indisponível; os dois tempos usaram getDataArray."
+    elif diferentes:
+        mensagem += f" AVISO: conteúdo diferente em: {', '.join(diferentes)}."
+    status_cell.setString(mensagem)
+
+
+def _normalizar_matriz_extraida(data_array):
+    """Converte as células em texto e descarta linhas e colunas vazias no final, para comparação."""
+    linhas = [[_valor_celula_para_texto(valor) for valor in row] for row in data_array]
+    while linhas and not any(linhas[-1]):
+        linhas.pop()
+    largura = max((max((i + 1 for i, v in enumerate(row) if v), default=0) for row in linhas), default=0)
+    return [row[:largura] for row in linhas]
+
+
+def _caminho_importacao(doc):
+    try:
+        return doc.getSheets().getByName(NOME_ABA_GERAL).getCellByPosition(*CELULA_CAMINHO_IMPORTACAO).getString()
+    except Exception:
+        return ''
+
+
+def _adicionar_ao_plano(plano_exportacao, dados_agrupados_por_arquivo, apenas_existentes=False):
+    """Acrescenta ao plano {origem: {entidade: [blocos]}} os blocos renderizados de uma aba."""
+    for relative_path, blocos_por_entidade in dados_agrupados_por_arquivo.items():
+        if apenas_existentes and relative_path not in plano_exportacao:
+            continue
+        destino = plano_exportacao.setdefault(relative_path, {})
+        for entidade_nome, blocos in blocos_por_entidade.items():
+            destino.setdefault(entidade_nome, []).extend(blocos)
+
+
+def _completar_plano_com_outras_abas(doc, plano_exportacao, abas_renderizadas, abas_com_falha, origens_bloqueadas, extracao=None):
+    """
+    Na exportação parcial, um arquivo com várias entidades precisa também dos blocos das
+    abas não selecionadas; caso contrário elas sumiriam do arquivo regravado. As abas são
+    achadas pela coluna 'Origem' (inclui a aba com o nome do arquivo, que guarda os includes
+    do topo). Só são acrescentados blocos de arquivos que já estão no plano. Abas que já
+    falharam não são lidas de novo; as que falham aqui também bloqueiam seus arquivos.
+    """
+    erros = []
+    ja_processadas = abas_renderizadas | abas_com_falha
+    outras_abas = [sheet for sheet in _abas_de_entidades(doc) if sheet.getName().lower() not in ja_processadas]
+    indice = _indice_origens_abas(doc, outras_abas)
+    faltantes = {sheet_name for origem in list(plano_exportacao) + [None] for sheet_name in indice.get(origem, [])}
+    sheets = doc.getSheets()
+    for sheet_name in sorted(faltantes):
+        sheet = sheets.getByName(sheet_name)
+        data_array = _ler_dados_para_exportacao(doc, sheet, extracao)
+        if data_array and data_array[0] and data_array[0][0] == MARCADOR_ABA_PENDENTE:
+            erros.append(f"Aba '{sheet_name}' não foi materializada e seus dados não estão mais em memória; reimporte a base.")
+            _registrar_falha_aba(sheet_name, data_array, abas_com_falha, origens_bloqueadas)
+            continue
+        dados_agrupados_por_arquivo, erro = _renderizar_dados_folha(sheet_name, data_array)
+        if erro:
+            erros.append(erro)
+            _registrar_falha_aba(sheet_name, data_array, abas_com_falha, origens_bloqueadas)
+            continue
+        _adicionar_ao_plano(plano_exportacao, dados_agrupados_por_arquivo, apenas_existentes=True)
+    return erros
+
+
+def _registrar_falha_aba(sheet_name, data_array, abas_com_falha, origens_bloqueadas):
+    """
+    Anota a aba que não pôde ser renderizada e bloqueia a gravação dos arquivos de origem
+    que têm linhas dela (todos, com None, se a aba não tem a coluna 'Origem').
+    """
+    abas_com_falha.add(sheet_name.lower())
+    headers = data_array[0] if data_array else ()
+    if CABEÇALHO_COLUNA_ORIGEM not in headers:
+        origens_bloqueadas.add(None)
+        return
+    origem_col_idx = headers.index(CABEÇALHO_COLUNA_ORIGEM)
+    origens_bloqueadas.update(
+        str(row[origem_col_idx]) for row in data_array[1:] if len(row) > origem_col_idx and row[origem_col_idx]
+    )
+
+
+def _indice_origens_abas(doc, abas):
+    """
+    Retorna {origem: [abas com linhas dessa origem]}, lendo de cada aba só a coluna 'Origem'
+    (abas não materializadas usam os pontos em memória). Abas com o marcador de pendência
+    cujos dados se perderam ficam na chave None, pois não há como saber suas origens.
+    """
+    pendentes = _estado_documento(doc)['pendentes']
+    indice = {}
+    for sheet in abas:
+        sheet_name = sheet.getName()
+        if sheet_name in pendentes:
+            origens = {ponto.get('origem', '') for ponto in pendentes[sheet_name]}
+        else:
+            origens = _ler_origens_folha(sheet)
+        for origem in origens:
+            if origem != '':
+                indice.setdefault(origem, []).append(sheet_name)
+    return indice
+
+
+def _ler_origens_folha(sheet):
+    """Valores distintos da coluna 'Origem' da aba ({None} se a aba só tem o marcador de pendência)."""
     cursor = sheet.createCursor()
     cursor.gotoEndOfUsedArea(False)
     data_range = cursor.getRangeAddress()
-    data_array = sheet.getCellRangeByPosition(0, 0, data_range.EndColumn, data_range.EndRow).getDataArray()
+    headers = sheet.getCellRangeByPosition(0, 0, data_range.EndColumn, 0).getDataArray()[0]
+    if headers and headers[0] == MARCADOR_ABA_PENDENTE:
+        return {None}
+    if CABEÇALHO_COLUNA_ORIGEM not in headers or data_range.EndRow < 1:
+        return set()
+    col_idx = headers.index(CABEÇALHO_COLUNA_ORIGEM)
+    coluna = sheet.getCellRangeByPosition(col_idx, 1, col_idx, data_range.EndRow).getDataArray()
+    return {str(row[0]) for row in coluna}
 
-    if not data_array or len(data_array) < 2: return
+
+def _ordem_entidades_arquivo(relative_path, pastas):
+    """
+    Ordem em que as entidades aparecem pela primeira vez na versão original do arquivo,
+    obtida pela mesma varredura em bytes do censo. Só é usada para blocos sem posição
+    (ex.: abas de versões anteriores, sem a coluna 'Posicao'). Retorna [] se o arquivo não existir.
+    """
+    for pasta in pastas:
+        if not pasta:
+            continue
+        full_path = os.path.join(pasta, relative_path)
+        if not os.path.isfile(full_path):
+            continue
+        try:
+            with open(full_path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return []
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                    ordem = []
+                    for match in REGEX_CENSO_INICIO_BLOCO.finditer(buffer):
+                        entidade_nome = match.group(2).decode('latin-1').lower()
+                        if entidade_nome not in ordem:
+                            ordem.append(entidade_nome)
+                    return ordem
+        except (IOError, ValueError):
+            continue
+    return []
+
+
+def _ordenar_plano_exportacao(plano_exportacao, pastas_originais, ordem_entidades):
+    """
+    Junta os blocos de cada arquivo intercalando as entidades pela posição registrada no
+    parse. Dentro de uma entidade vale a ordem das linhas na aba: uma linha movida ou
+    copiada não passa à frente das anteriores. Blocos sem nenhuma referência de posição
+    vão para o fim, pela ordem das entidades no arquivo original, depois pela aba 'MaisUsadas'.
+    """
+    prioridade_entidades = {entidade: idx for idx, entidade in enumerate(ordem_entidades)}
+    conteudo_por_arquivo = {}
+    for relative_path, blocos_por_entidade in plano_exportacao.items():
+        sem_posicao = any(
+            chave[0] == float('inf') for blocos in blocos_por_entidade.values() for chave, _ in blocos
+        )
+        ordem_original = {}
+        if sem_posicao:
+            ordem_original = {
+                entidade: idx for idx, entidade in enumerate(_ordem_entidades_arquivo(relative_path, pastas_originais))
+            }
+        blocos_ordenados = []
+        for entidade_nome, blocos in blocos_por_entidade.items():
+            prioridade = (
+                ordem_original.get(entidade_nome, float('inf')),
+                prioridade_entidades.get(entidade_nome, float('inf'))
+            )
+            chave_anterior = None
+            for chave, bloco in blocos:
+                # A chave só cresce dentro da entidade, preservando a ordem da aba.
+                if chave_anterior is not None and chave < chave_anterior:
+                    chave = chave_anterior
+                chave_anterior = chave
+                blocos_ordenados.append((chave, prioridade, len(blocos_ordenados), bloco))
+        blocos_ordenados.sort(key=lambda item: item[:3])
+        conteudo_por_arquivo[relative_path] = [item[3] for item in blocos_ordenados]
+    return conteudo_por_arquivo
+
+
+def _validar_dados_folha(sheet_name, data_array, regras_validacao):
+    """
+    Confere, em uma única passada, todos os atributos dos blocos (x/c) da aba contra
+    os conjuntos de valores permitidos. Retorna tuplas (aba, linha, coluna, entidade, atributo, valor),
+    com linha/coluna indexadas a partir de 0 na aba.
+    """
+    if not regras_validacao or not data_array or len(data_array) < 2:
+        return []
+
+    headers = data_array[0]
+    try:
+        gera_col_idx = headers.index(CABEÇALHO_COLUNA_CONTROLE)
+    except ValueError:
+        return []
+    entidade_col_idx = headers.index(CABEÇALHO_COLUNA_ENTIDADE) if CABEÇALHO_COLUNA_ENTIDADE in headers else None
+    if entidade_col_idx is None and sheet_name.lower() not in regras_validacao:
+        return []
+
+    colunas_atributos = [
+        (col_idx, str(header).upper())
+        for col_idx, header in enumerate(headers)
+        if header not in CABEÇALHOS_FIXOS
+    ]
+
+    violacoes = []
+    for row_idx, row_data in enumerate(data_array[1:], 1):
+        if len(row_data) <= gera_col_idx: continue
+        control_code = str(row_data[gera_col_idx]).lower()
+        if control_code not in [CODIGO_BLOCO_ATIVO, CODIGO_BLOCO_COMENTADO]: continue
+        entidade_nome = sheet_name.lower()
+        if entidade_col_idx is not None and len(row_data) > entidade_col_idx:
+            entidade_nome = str(row_data[entidade_col_idx]).strip().lower()
+        regras = regras_validacao.get(entidade_nome)
+        if not regras: continue
+        for col_idx, atributo in colunas_atributos:
+            permitidos = regras.get(atributo)
+            if permitidos is None or col_idx >= len(row_data): continue
+            valor = _valor_celula_para_texto(row_data[col_idx]).strip()
+            if valor and valor.upper() not in permitidos:
+                violacoes.append((sheet_name, row_idx, col_idx, entidade_nome, atributo, valor))
+    return violacoes
+
+
+def _publicar_relatorio_validacao(doc, violacoes, regras_validacao):
+    """
+    Recria a aba de relatório com um único setDataArray e destaca as células inválidas
+    agrupando-as em intervalos contíguos (uma operação de formatação por aba).
+    """
+    sheets = doc.getSheets()
+    if sheets.hasByName(NOME_ABA_RELATORIO_VALIDACAO):
+        sheets.removeByName(NOME_ABA_RELATORIO_VALIDACAO)
+    if DESTACAR_CELULAS_INVALIDAS:
+        # Também roda sem violações, para apagar os destaques da validação anterior.
+        _destacar_celulas_invalidas(doc, violacoes)
+    if not violacoes:
+        return
+
+    sheets.insertNewByName(NOME_ABA_RELATORIO_VALIDACAO, sheets.getCount())
+    report_sheet = sheets.getByName(NOME_ABA_RELATORIO_VALIDACAO)
+    data_matrix = [("Aba", "Linha", "Entidade", "Atributo", "Valor", "Valores Permitidos")]
+    for sheet_name, row_idx, _, entidade_nome, atributo, valor in violacoes:
+        permitidos = regras_validacao.get(entidade_nome, {}).get(atributo, set())
+        data_matrix.append((sheet_name, str(row_idx + 1), entidade_nome, atributo, valor, ", ".join(sorted(permitidos))))
+    report_sheet.getCellRangeByPosition(0, 0, len(data_matrix[0]) - 1, len(data_matrix) - 1).setDataArray(tuple(data_matrix))
+    columns = report_sheet.getColumns()
+    for i in range(len(data_matrix[0])):
+        columns.getByIndex(i).OptimalWidth = True
+
+
+def _destacar_celulas_invalidas(doc, violacoes):
+    """
+    Pinta as células inválidas usando um SheetCellRanges por aba. Antes, devolve a cor
+    zebrada às células destacadas na validação anterior. A pintura não conta como
+    alteração da aba para a exportação das alteradas.
+    """
+    if uno is None:
+        return
+
+    estado = _estado_documento(doc)
+    alteradas_antes = set(estado['alteradas'])
+    sheets = doc.getSheets()
+    _restaurar_destaques(doc, estado['destaques'])
+    estado['destaques'] = {}
+
+    # Abas não materializadas não têm células para destacar (só o relatório).
+    pendentes = estado['pendentes']
+    celulas_por_aba = {}
+    for sheet_name, row_idx, col_idx, _, _, _ in violacoes:
+        if sheet_name in pendentes: continue
+        celulas_por_aba.setdefault(sheet_name, {}).setdefault(col_idx, []).append(row_idx)
+
+    for sheet_name, linhas_por_coluna in celulas_por_aba.items():
+        sheet_idx = sheets.getByName(sheet_name).getRangeAddress().Sheet
+        intervalos = []
+        for col_idx, linhas in linhas_por_coluna.items():
+            linhas = sorted(linhas)
+            inicio = anterior = linhas[0]
+            for linha in linhas[1:] + [None]:
+                if linha is not None and linha == anterior + 1:
+                    anterior = linha
+                    continue
+                intervalos.append((col_idx, inicio, anterior))
+                if linha is not None:
+                    inicio = anterior = linha
+
+        enderecos = [
+            uno.createUnoStruct("com.sun.star.table.CellRangeAddress", sheet_idx, col_idx, inicio, col_idx, fim)
+            for col_idx, inicio, fim in intervalos
+        ]
+        ranges = doc.createInstance("com.sun.star.sheet.SheetCellRanges")
+        ranges.addRangeAddresses(tuple(enderecos), False)
+        ranges.CellBackColor = COR_CELULA_INVALIDA
+        estado['destaques'][sheet_name] = intervalos
+
+    estado['alteradas'].intersection_update(alteradas_antes)
+
+
+def _restaurar_destaques(doc, destaques):
+    """Devolve a cor das linhas alternadas às células de {aba: [(coluna, linha_inicial, linha_final)]}."""
+    sheets = doc.getSheets()
+    for sheet_name, intervalos in destaques.items():
+        if not sheets.hasByName(sheet_name):
+            continue
+        sheet_idx = sheets.getByName(sheet_name).getRangeAddress().Sheet
+        enderecos_por_cor = {}
+        for col_idx, inicio, fim in intervalos:
+            for linha in range(inicio, fim + 1):
+                cor = COR_LINHA_IMPAR if linha % 2 != 0 else COR_LINHA_PAR
+                enderecos_por_cor.setdefault(cor, []).append(uno.createUnoStruct(
+                    "com.sun.star.table.CellRangeAddress", sheet_idx, col_idx, linha, col_idx, linha
+                ))
+        for cor, enderecos in enderecos_por_cor.items():
+            ranges = doc.createInstance("com.sun.star.sheet.SheetCellRanges")
+            ranges.addRangeAddresses(tuple(enderecos), False)
+            ranges.CellBackColor = cor
+
+
+def _renderizar_dados_folha(sheet_name, data_array):
+    """
+    Converte as linhas de uma aba (ou matriz equivalente) nos blocos de texto do .dat,
+    agrupados pelo arquivo de origem e pela entidade. Em abas agrupadas, a entidade de
+    cada linha vem da coluna 'Entidade'. Retorna ({origem: {entidade: [(chave, bloco)]}}, erro),
+    onde chave é a (posição, deslocamento) do bloco no arquivo usada para ordená-lo.
+    """
+    if not data_array or len(data_array) < 2: return {}, None
 
     headers = data_array[0]
     try:
@@ -775,16 +2309,44 @@ def _exportar_folha(sheet, export_folder):
         gera_col_idx = headers.index(CABEÇALHO_COLUNA_CONTROLE)
         dados_col_idx = headers.index(CABEÇALHO_COLUNA_DADOS)
     except ValueError:
-        return f"Aba '{sheet_name}' não possui as colunas 'Origem', 'Gera' ou 'Dados'."
+        return {}, f"Aba '{sheet_name}' não possui as colunas 'Origem', 'Gera' ou 'Dados'."
+    entidade_col_idx = headers.index(CABEÇALHO_COLUNA_ENTIDADE) if CABEÇALHO_COLUNA_ENTIDADE in headers else None
+    posicao_col_idx = headers.index(CABEÇALHO_COLUNA_POSICAO) if CABEÇALHO_COLUNA_POSICAO in headers else None
 
     dados_agrupados_por_arquivo = {}
+    # Linhas sem posição (inseridas na aba) seguem a última linha com posição da mesma origem;
+    # as que vêm antes de qualquer posição esperam a próxima ({origem: [chave mutável]}).
+    referencia_por_origem = {}
+    aguardando_por_origem = {}
 
-    for row_data in data_array[1:]:
+    for row_idx, row_data in enumerate(data_array[1:], 1):
         if len(row_data) <= max(origem_col_idx, gera_col_idx, dados_col_idx): continue
         origem_path = str(row_data[origem_col_idx])
         control_code = str(row_data[gera_col_idx]).lower()
-        if not origem_path or not control_code or control_code == CODIGO_IGNORAR_LINHA: continue
-        dados_agrupados_por_arquivo.setdefault(origem_path, [])
+        if not origem_path: continue
+        posicao = _posicao_da_celula(row_data[posicao_col_idx]) if posicao_col_idx is not None and len(row_data) > posicao_col_idx else None
+        if posicao is not None:
+            referencia_por_origem[origem_path] = [posicao, 0]
+            aguardando = aguardando_por_origem.pop(origem_path, [])
+            for deslocamento, chave in enumerate(aguardando):
+                chave[:] = [posicao, deslocamento - len(aguardando)]
+            chave_linha = [posicao, 0]
+        elif origem_path in referencia_por_origem:
+            referencia = referencia_por_origem[origem_path]
+            referencia[1] += 1
+            chave_linha = list(referencia)
+        else:
+            aguardando = aguardando_por_origem.setdefault(origem_path, [])
+            chave_linha = [float('inf'), len(aguardando)]
+            aguardando.append(chave_linha)
+        if not control_code or control_code == CODIGO_IGNORAR_LINHA: continue
+        blocos_do_arquivo = dados_agrupados_por_arquivo.setdefault(origem_path, {})
+        entidade_nome = sheet_name.lower()
+        if entidade_col_idx is not None:
+            entidade_linha = str(row_data[entidade_col_idx]).strip().lower() if len(row_data) > entidade_col_idx else ''
+            if not entidade_linha and control_code in [CODIGO_BLOCO_ATIVO, CODIGO_BLOCO_COMENTADO]:
+                return {}, f"Aba '{sheet_name}' linha {row_idx + 1}: bloco sem entidade na coluna '{CABEÇALHO_COLUNA_ENTIDADE}'."
+            entidade_nome = entidade_linha or entidade_nome
         bloco_final = None
         dado_principal = str(row_data[dados_col_idx])
         if control_code == CODIGO_INCLUDE and dado_principal:
@@ -797,46 +2359,555 @@ def _exportar_folha(sheet, export_folder):
             comment_lines = [line for line in dado_principal.splitlines()]
             attribute_lines = []
             for col_idx, header in enumerate(headers):
-                if header in [CABEÇALHO_COLUNA_ORIGEM, CABEÇALHO_COLUNA_CONTROLE, CABEÇALHO_COLUNA_DADOS]:
+                if header in CABEÇALHOS_FIXOS:
                     continue
-                value = str(row_data[col_idx]) if len(row_data) > col_idx else ""
+                value = _valor_celula_para_texto(row_data[col_idx]) if len(row_data) > col_idx else ""
                 if value:
                     attribute_lines.append(f"\t{header} = {value}")
 
             if comment_lines or attribute_lines:
                 if control_code == CODIGO_BLOCO_COMENTADO:
-                    point_lines = [f";{sheet_name.upper()}"]
+                    point_lines = [f";{entidade_nome.upper()}"]
                     point_lines.extend([f";{line}" for line in comment_lines])
                     point_lines.extend([f";{line}" for line in attribute_lines])
                 else:
-                    point_lines = [sheet_name.upper()]
+                    point_lines = [entidade_nome.upper()]
                     point_lines.extend([f";{line}" for line in comment_lines])
                     point_lines.extend(attribute_lines)
                 bloco_final = "\n".join(point_lines)
         if bloco_final is not None:
-            dados_agrupados_por_arquivo[origem_path].append(bloco_final)
-            
-    # Itera sobre os dados agrupados e escreve cada arquivo.
+            blocos_do_arquivo.setdefault(entidade_nome, []).append((chave_linha, bloco_final))
+    # As chaves das linhas em espera só são conhecidas no fim da aba.
+    for blocos_por_entidade in dados_agrupados_por_arquivo.values():
+        for entidade_nome, blocos in blocos_por_entidade.items():
+            blocos_por_entidade[entidade_nome] = [(tuple(chave), bloco) for chave, bloco in blocos]
+    return dados_agrupados_por_arquivo, None
+
+
+def _posicao_da_celula(valor):
+    """Posição gravada na coluna 'Posicao' (texto ou número); None se vazia ou inválida."""
+    texto = _valor_celula_para_texto(valor).strip()
+    try:
+        return int(float(texto)) if texto else None
+    except ValueError:
+        return None
+
+
+def _escrever_arquivos(dados_agrupados_por_arquivo, export_folder):
+    """
+    Escreve cada arquivo de origem com seus blocos. Arquivos cujo conteúdo não mudou não
+    são reescritos; o conteúdo anterior dos demais vai para o armazenamento de backups.
+    Retorna (erro, id da execução de backup, ou None se nenhum arquivo mudou).
+    """
+    execucao = _iniciar_execucao_backup('exportacao')
+    erro = None
     for relative_path, file_content_list in dados_agrupados_por_arquivo.items():
         try:
-            full_output_path = os.path.join(export_folder, relative_path)
-            
-            # --- INÍCIO DA LÓGICA DE BACKUP ---
+            texto = "\n\n".join(file_content_list) + "\n"
+            novo_conteudo = texto.replace("\n", os.linesep).encode(ENCODING_EXPORTACAO_SAGE)
+            _gravar_com_backup(export_folder, execucao, relative_path, novo_conteudo)
+        except (IOError, UnicodeEncodeError) as e:
+            erro = f"Falha ao escrever {relative_path}: {e}"
+            break
+
+    try:
+        _finalizar_execucao_backup(export_folder, execucao)
+    except IOError as e:
+        return erro or f"Falha ao gravar o manifesto de backup: {e}", None
+    return erro, execucao['id'] if execucao['arquivos'] else None
+
+# ===============================================================
+# ================ ARMAZENAMENTO DE BACKUPS =====================
+# ===============================================================
+# Cada conteúdo anterior é guardado uma única vez, endereçado pelo seu SHA-256
+# (objetos/ab/abcdef...), e cada exportação registra um manifesto
+# {arquivo: hash do conteúdo anterior, ou null se o arquivo não existia}.
+
+def restaurar_backup(*args):
+    """
+    Restaura os arquivos da pasta de exportação para o estado anterior a uma exportação.
+    Usa a execução informada em A8 da aba 'geral' ou, se vazio, a mais recente.
+    A própria restauração gera uma nova execução, então pode ser desfeita da mesma forma.
+    """
+    doc = XSCRIPTCONTEXT.getDocument() # type: ignore
+    geral_sheet = doc.getSheets().getByName(NOME_ABA_GERAL)
+    status_cell = geral_sheet.getCellByPosition(*CELULA_STATUS_EXPORTACAO)
+    export_folder = geral_sheet.getCellByPosition(*CELULA_CAMINHO_EXPORTACAO).getString()
+    if not os.path.isdir(export_folder):
+        status_cell.setString("ERRO: O caminho de destino não é uma pasta válida.")
+        return
+
+    id_execucao = geral_sheet.getCellByPosition(*CELULA_ID_BACKUP).getString().strip() or None
+    try:
+        id_restaurado, restaurados = restaurar_execucao_backup(export_folder, id_execucao)
+    except (IOError, ValueError) as e:
+        status_cell.setString(f"ERRO: Falha ao restaurar backup. {e}")
+        return
+    status_cell.setString(f"Backup {id_restaurado} restaurado: {restaurados} arquivo(s).")
+
+
+def restaurar_execucao_backup(export_folder, id_execucao=None):
+    """Restaura uma execução do armazenamento. Retorna (id_execucao, arquivos_restaurados)."""
+    execucoes = _listar_execucoes_backup(export_folder)
+    if not execucoes:
+        raise ValueError("não há backups nesta pasta de exportação")
+    if id_execucao is None:
+        id_execucao = execucoes[-1]
+    elif id_execucao not in execucoes:
+        raise ValueError(f"execução '{id_execucao}' não encontrada")
+
+    with open(_caminho_manifesto_backup(export_folder, id_execucao), 'r', encoding='utf-8') as f:
+        manifesto = json.load(f)
+
+    execucao = _iniciar_execucao_backup('restauracao', origem=id_execucao)
+    for relative_path, hash_conteudo in manifesto['arquivos'].items():
+        full_output_path = os.path.join(export_folder, relative_path)
+        if hash_conteudo is None:
+            # O arquivo foi criado por aquela exportação: restaurar significa removê-lo.
             if os.path.exists(full_output_path):
-                backup_path = full_output_path + ".bak"
-                # Remove um backup antigo, se existir, para evitar erros no rename
-                if os.path.exists(backup_path):
-                    os.remove(backup_path)
-                os.rename(full_output_path, backup_path)
-            # --- FIM DA LÓGICA DE BACKUP ---
-
-            os.makedirs(os.path.dirname(full_output_path), exist_ok=True)
-            with open(full_output_path, 'w', encoding=ENCODING_EXPORTACAO_SAGE) as f:
-                f.write("\n\n".join(file_content_list)); f.write("\n")
-        except IOError as e:
-            return f"Falha ao escrever {relative_path}: {e}"
-            
-    return None
+                _guardar_conteudo_anterior(export_folder, execucao, relative_path, full_output_path)
+                os.remove(full_output_path)
+            continue
+        _gravar_com_backup(export_folder, execucao, relative_path, _ler_objeto_backup(export_folder, hash_conteudo))
+    _finalizar_execucao_backup(export_folder, execucao)
+    return id_execucao, len(manifesto['arquivos'])
+
+
+def _iniciar_execucao_backup(tipo, origem=None):
+    # Uma única leitura do relógio, para que segundos e milissegundos sejam do mesmo instante.
+    agora = time.time()
+    momento = time.localtime(agora)
+    return {
+        'id': time.strftime('%Y%m%d-%H%M%S', momento) + f"-{int(agora * 1000) % 1000:03d}",
+        'data': time.strftime('%Y-%m-%d %H:%M:%S', momento),
+        'tipo': tipo,
+        'origem': origem,
+        'arquivos': {}
+    }
+
+
+def _gravar_com_backup(export_folder, execucao, relative_path, novo_conteudo):
+    """Grava o arquivo guardando antes o conteúdo anterior. Retorna False se nada mudou."""
+    full_output_path = os.path.join(export_folder, relative_path)
+    if os.path.exists(full_output_path):
+        with open(full_output_path, 'rb') as f:
+            conteudo_anterior = f.read()
+        if conteudo_anterior == novo_conteudo:
+            return False
+        execucao['arquivos'][relative_path] = _guardar_objeto_backup(export_folder, conteudo_anterior)
+    else:
+        execucao['arquivos'][relative_path] = None
+
+    os.makedirs(os.path.dirname(full_output_path), exist_ok=True)
+    with open(full_output_path, 'wb') as f:
+        f.write(novo_conteudo)
+    return True
+
+
+def _guardar_conteudo_anterior(export_folder, execucao, relative_path, full_path):
+    with open(full_path, 'rb') as f:
+        execucao['arquivos'][relative_path] = _guardar_objeto_backup(export_folder, f.read())
+
+
+def _caminho_objeto_backup(export_folder, hash_conteudo):
+    return os.path.join(export_folder, PASTA_BACKUP, 'objetos', hash_conteudo[:2], hash_conteudo)
+
+
+def _caminho_manifesto_backup(export_folder, id_execucao):
+    return os.path.join(export_folder, PASTA_BACKUP, 'manifestos', id_execucao + '.json')
+
+
+def _guardar_objeto_backup(export_folder, conteudo):
+    """Guarda o conteúdo (deduplicado pelo hash) e retorna o hash."""
+    hash_conteudo = hashlib.sha256(conteudo).hexdigest()
+    caminho = _caminho_objeto_backup(export_folder, hash_conteudo)
+    if os.path.exists(caminho) or os.path.exists(caminho + '.z'):
+        return hash_conteudo
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    if BACKUP_COMPRIMIR:
+        caminho += '.z'
+        conteudo = zlib.compress(conteudo)
+    # Grava em arquivo temporário e renomeia, para nunca deixar um objeto truncado.
+    with open(caminho + '.tmp', 'wb') as f:
+        f.write(conteudo)
+    os.replace(caminho + '.tmp', caminho)
+    return hash_conteudo
+
+
+def _ler_objeto_backup(export_folder, hash_conteudo):
+    caminho = _caminho_objeto_backup(export_folder, hash_conteudo)
+    if os.path.exists(caminho + '.z'):
+        with open(caminho + '.z', 'rb') as f:
+            return zlib.decompress(f.read())
+    with open(caminho, 'rb') as f:
+        return f.read()
+
+
+def _listar_execucoes_backup(export_folder):
+    pasta = os.path.join(export_folder, PASTA_BACKUP, 'manifestos')
+    if not os.path.isdir(pasta):
+        return []
+    return sorted(os.path.splitext(f)[0] for f in os.listdir(pasta) if f.endswith('.json'))
+
+
+def _finalizar_execucao_backup(export_folder, execucao):
+    """Grava o manifesto da execução (se algo mudou) e aplica a política de retenção."""
+    if not execucao['arquivos']:
+        return
+    caminho = _caminho_manifesto_backup(export_folder, execucao['id'])
+    sufixo = 1
+    while os.path.exists(caminho):
+        execucao['id'] = f"{execucao['id'].split('_')[0]}_{sufixo}"
+        caminho = _caminho_manifesto_backup(export_folder, execucao['id'])
+        sufixo += 1
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    with open(caminho, 'w', encoding='utf-8') as f:
+        json.dump(execucao, f, ensure_ascii=False, indent=1)
+    _aplicar_retencao_backup(export_folder)
+
+
+def _aplicar_retencao_backup(export_folder):
+    """Remove as execuções excedentes e os objetos que nenhum manifesto restante referencia."""
+    execucoes = _listar_execucoes_backup(export_folder)
+    excedentes = execucoes[:-BACKUP_MAX_EXECUCOES] if len(execucoes) > BACKUP_MAX_EXECUCOES else []
+    if not excedentes:
+        return
+    for id_execucao in excedentes:
+        os.remove(_caminho_manifesto_backup(export_folder, id_execucao))
+
+    referenciados = set()
+    for id_execucao in execucoes[len(excedentes):]:
+        with open(_caminho_manifesto_backup(export_folder, id_execucao), 'r', encoding='utf-8') as f:
+            referenciados.update(h for h in json.load(f)['arquivos'].values() if h)
+
+    pasta_objetos = os.path.join(export_folder, PASTA_BACKUP, 'objetos')
+    for root, _, files in os.walk(pasta_objetos):
+        for file_name in files:
+            hash_conteudo = file_name[:-2] if file_name.endswith('.z') else file_name
+            if hash_conteudo not in referenciados:
+                os.remove(os.path.join(root, file_name))
+
+# ===============================================================
+# ========== GERADOR DE SCRIPTS DE SIMULAÇÃO (SIMUL) ============
+# ===============================================================
+
+def gerar_simul(*args):
+    """
+    Gera o script de simulação da base da pasta de importação, direto dos .dat, sem montar
+    abas. Os templates e filtros vêm da aba 'simul' (colunas Entidade | Template | Filtro,
+    a partir da linha 2); sem ela, usa TEMPLATES_SIMUL_PADRAO.
+    """
+    doc = XSCRIPTCONTEXT.getDocument() # type: ignore
+    geral_sheet = doc.getSheets().getByName(NOME_ABA_GERAL)
+    status_cell = geral_sheet.getCellByPosition(*CELULA_STATUS_EXPORTACAO)
+    folder_path = geral_sheet.getCellByPosition(*CELULA_CAMINHO_IMPORTACAO).getString()
+    export_folder = geral_sheet.getCellByPosition(*CELULA_CAMINHO_EXPORTACAO).getString()
+    if not os.path.isdir(folder_path):
+        status_cell.setString("ERRO: O caminho de importação não é uma pasta válida.")
+        return
+    if not os.path.isdir(export_folder):
+        status_cell.setString("ERRO: O caminho de destino não é uma pasta válida.")
+        return
+
+    templates, filtros = _carregar_templates_simul(doc)
+    output_path = os.path.join(export_folder, NOME_ARQUIVO_SIMUL)
+    diagnostico = DiagnosticoImportacao()
+    status_cell.setString("Gerando script de simulação...")
+    start_time = time.perf_counter()
+    try:
+        passos = gerar_script_simulacao(folder_path, output_path, templates, filtros, diagnostico)
+    except (IOError, ValueError, KeyError, IndexError, UnicodeEncodeError) as e:
+        status_cell.setString(f"ERRO: Falha ao gerar o script de simulação. {e}")
+        return
+    elapsed = time.perf_counter() - start_time
+    diagnostico.publicar(doc)
+    status_cell.setString(
+        f"Script de simulação gerado em {elapsed:.3f}s: {passos} passo(s) em {output_path}."
+        + _sufixo_diagnostico(diagnostico)
+    )
+
+
+def gerar_script_simulacao(base_folder_path, output_path, templates, filtros=None, diagnostico=None):
+    """
+    Percorre a base arquivo por arquivo e grava um passo por bloco ativo das entidades com
+    template, respeitando os filtros. Só os pontos do arquivo atual e um buffer de
+    SIMUL_TAMANHO_BUFFER linhas ficam em memória. Retorna o número de passos gerados.
+    """
+    filtros = filtros or {}
+    passos = 0
+    buffer = []
+    with open(output_path, 'w', encoding=ENCODING_EXPORTACAO_SAGE) as f:
+        for entidade_nome, ponto in _iterar_pontos_base(base_folder_path, diagnostico):
+            template = templates.get(entidade_nome)
+            if template is None or ponto['type'] != CODIGO_BLOCO_ATIVO:
+                continue
+            if not _ponto_atende_filtros(ponto, filtros.get(entidade_nome, [])):
+                continue
+            campos = _CamposSimul(ponto['attributes'])
+            campos['ENTIDADE'] = entidade_nome.upper()
+            campos['ORIGEM'] = ponto.get('origem', '')
+            buffer.append(template.format_map(campos))
+            passos += 1
+            if len(buffer) >= SIMUL_TAMANHO_BUFFER:
+                f.write("\n".join(buffer)); f.write("\n")
+                buffer.clear()
+        if buffer:
+            f.write("\n".join(buffer)); f.write("\n")
+    return passos
+
+
+class _CamposSimul(dict):
+    """Dicionário para format_map: atributos ausentes viram texto vazio."""
+    def __missing__(self, key):
+        return ''
+
+
+def _iterar_pontos_base(base_folder_path, diagnostico=None):
+    """Gera (entidade, ponto) arquivo por arquivo, descartando cada arquivo após o uso."""
+    for root, _, files in os.walk(base_folder_path):
+        entidades_validas_set = {os.path.splitext(f)[0].upper() for f in files if f.lower().endswith('.dat')}
+        for file_name in files:
+            if not file_name.lower().endswith('.dat'):
+                continue
+            full_path = os.path.join(root, file_name)
+            dados_arquivo = {}
+            parse_dat_file(full_path, os.path.relpath(full_path, base_folder_path), dados_arquivo, entidades_validas_set, diagnostico)
+            for entidade_nome, pontos in dados_arquivo.items():
+                for ponto in pontos:
+                    yield entidade_nome, ponto
+
+
+def _carregar_templates_simul(doc):
+    """
+    Lê da aba 'simul' os templates ({entidade: template}) e filtros ({entidade: [condições]}).
+    O filtro aceita condições 'ATRIBUTO=valor' ou 'ATRIBUTO!=valor' separadas por ';',
+    com curingas * e ? e sem diferenciar maiúsculas.
+    """
+    templates = {}
+    filtros = {}
+    sheets = doc.getSheets()
+    if sheets.hasByName(NOME_ABA_SIMUL):
+        data = _ler_dados_folha(sheets.getByName(NOME_ABA_SIMUL))
+        for row_data in data[1:]:
+            if len(row_data) < 2 or not row_data[0] or not row_data[1]: continue
+            entidade_nome = str(row_data[0]).lower().strip()
+            templates[entidade_nome] = str(row_data[1])
+            if len(row_data) > 2 and str(row_data[2]).strip():
+                filtros[entidade_nome] = _compilar_filtro_simul(str(row_data[2]))
+    return (templates or dict(TEMPLATES_SIMUL_PADRAO)), filtros
+
+
+def _compilar_filtro_simul(texto_filtro):
+    condicoes = []
+    for condicao in texto_filtro.split(';'):
+        if '=' not in condicao:
+            continue
+        atributo, padrao = condicao.split('=', 1)
+        negado = atributo.endswith('!')
+        atributo = atributo.rstrip('!').strip().upper()
+        regex = re.compile(fnmatch.translate(padrao.strip()), re.IGNORECASE)
+        condicoes.append((atributo, regex, negado))
+    return condicoes
+
+
+def _ponto_atende_filtros(ponto, condicoes):
+    for atributo, regex, negado in condicoes:
+        corresponde = regex.match(ponto['attributes'].get(atributo, '')) is not None
+        if corresponde == negado:
+            return False
+    return True
+
+# ===============================================================
+# ================ PROCESSAMENTO EM LOTE (BASES) ================
+# ===============================================================
+
+def processar_lote(*args):
+    """
+    Importa e regenera várias bases de uma só vez, sem passar pelas abas.
+    As pastas vêm do intervalo RANGE_LOTE_BASES da aba 'geral' (entrada, saída) ou de
+    um arquivo de manifesto informado na primeira célula do intervalo. Sem pasta de saída,
+    a base é gravada em <caminho de exportação>/<nome da pasta de entrada>.
+    """
+    doc = XSCRIPTCONTEXT.getDocument() # type: ignore
+    geral_sheet = doc.getSheets().getByName(NOME_ABA_GERAL)
+    status_cell = geral_sheet.getCellByPosition(*CELULA_STATUS_EXPORTACAO)
+    export_root = geral_sheet.getCellByPosition(*CELULA_CAMINHO_EXPORTACAO).getString()
+
+    dados_lote = geral_sheet.getCellRangeByPosition(*RANGE_LOTE_BASES).getDataArray()
+    linhas = [
+        (str(row[0]).strip(), str(row[1]).strip() if len(row) > 1 else '')
+        for row in dados_lote if row and str(row[0]).strip()
+    ]
+    try:
+        if len(linhas) == 1 and os.path.isfile(linhas[0][0]):
+            linhas = _ler_manifesto_lote(linhas[0][0])
+    except IOError as e:
+        status_cell.setString(f"ERRO: Falha ao ler o manifesto do lote. {e}")
+        return
+
+    bases = []
+    saidas_usadas = {_chave_pasta_saida(saida) for _, saida in linhas if saida}
+    for entrada, saida in linhas:
+        if not saida and export_root:
+            # Bases de pastas homônimas (ex.: /a/SE1 e /b/SE1) ganham sufixo: SE1, SE1_2, ...
+            nome = os.path.basename(os.path.normpath(entrada))
+            saida = os.path.join(export_root, nome)
+            sufixo = 2
+            while _chave_pasta_saida(saida) in saidas_usadas:
+                saida = os.path.join(export_root, f"{nome}_{sufixo}")
+                sufixo += 1
+            saidas_usadas.add(_chave_pasta_saida(saida))
+        bases.append((entrada, saida))
+    if not bases:
+        status_cell.setString("AVISO: Nenhuma base listada para o processamento em lote.")
+        return
+
+    status_cell.setString(f"Processando lote de {len(bases)} base(s)...")
+    resultados = processar_bases(bases, SageConfig(doc))
+    _publicar_resumo_lote(doc, resultados)
+    diagnostico = DiagnosticoImportacao()
+    for r in resultados:
+        diagnostico.incorporar(r['diagnostico'], prefixo=r['entrada'])
+    diagnostico.publicar(doc)
+
+    com_erro = [r for r in resultados if r['erro']]
+    if com_erro:
+        status_cell.setString(f"ERRO: {len(com_erro)} de {len(resultados)} base(s) falharam. Veja a aba '{NOME_ABA_RESUMO_LOTE}'.")
+    else:
+        status_cell.setString(
+            f"Lote concluído: {len(resultados)} base(s) processadas com sucesso!" + _sufixo_diagnostico(diagnostico)
+        )
+
+
+def processar_bases(bases, config=None, max_workers=LOTE_MAX_WORKERS):
+    """
+    Processa uma lista de (pasta_entrada, pasta_saida) com um pool limitado de threads.
+    A configuração (ordem de atributos e regras de validação) é carregada uma única vez
+    e compartilhada, somente leitura, entre as bases. Não faz chamadas UNO. Uma pasta de
+    saída repetida é recusada nas bases seguintes, que rodariam ao mesmo tempo sobre os
+    mesmos arquivos e o mesmo armazenamento de backups.
+    """
+    if not bases:
+        return []
+    vistas = set()
+    tarefas = []
+    for entrada, saida in bases:
+        chave = _chave_pasta_saida(saida) if saida else None
+        tarefas.append((entrada, saida, chave is not None and chave in vistas))
+        vistas.add(chave)
+    workers = max(1, min(max_workers, len(bases)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda tarefa: _processar_base(tarefa[0], tarefa[1], config, tarefa[2]), tarefas))
+
+
+def _chave_pasta_saida(pasta):
+    return os.path.normcase(os.path.abspath(pasta))
+
+
+def _processar_base(base_folder_path, export_folder, config, saida_repetida=False):
+    """
+    Faz o parse completo de uma base e regrava seus .dat na pasta de saída. Cada base
+    tem seu próprio coletor de avisos, devolvido em resultado['diagnostico'].
+    """
+    inicio = time.perf_counter()
+    diagnostico = DiagnosticoImportacao()
+    resultado = {
+        'entrada': base_folder_path,
+        'saida': export_folder,
+        'arquivos': 0,
+        'pontos': 0,
+        'violacoes': 0,
+        'avisos': 0,
+        'tempo': 0.0,
+        'erro': '',
+        'diagnostico': diagnostico
+    }
+    try:
+        if not os.path.isdir(base_folder_path):
+            raise IOError("a pasta de entrada não é uma pasta válida")
+        if not export_folder:
+            raise IOError("pasta de saída não definida")
+        if saida_repetida:
+            raise IOError("pasta de saída repetida no lote (já usada por outra base)")
+
+        all_data = _coletar_dados_base(base_folder_path, diagnostico=diagnostico)
+        resultado['avisos'] = diagnostico.total
+        regras_validacao = config.regras_validacao if config else {}
+        plano_exportacao = {}
+        for entidade_nome, pontos in all_data.items():
+            data_matrix = _montar_matriz_pontos(entidade_nome, pontos, config)
+            resultado['pontos'] += len(pontos)
+            if regras_validacao:
+                resultado['violacoes'] += len(_validar_dados_folha(entidade_nome, data_matrix, regras_validacao))
+            dados_agrupados_por_arquivo, erro = _renderizar_dados_folha(entidade_nome, data_matrix)
+            if erro:
+                raise ValueError(erro)
+            _adicionar_ao_plano(plano_exportacao, dados_agrupados_por_arquivo)
+
+        conteudo_por_arquivo = _ordenar_plano_exportacao(
+            plano_exportacao, [base_folder_path], config.ordem_entidades if config else []
+        )
+        os.makedirs(export_folder, exist_ok=True)
+        erro, _ = _escrever_arquivos(conteudo_por_arquivo, export_folder)
+        if erro:
+            raise IOError(erro)
+        resultado['arquivos'] = len(conteudo_por_arquivo)
+    except Exception as e:
+        resultado['erro'] = str(e)
+
+    resultado['tempo'] = time.perf_counter() - inicio
+    _log_importacao(
+        'INFO',
+        f"Base {base_folder_path} processada em {resultado['tempo']:.3f}s. "
+        f"arquivos={resultado['arquivos']} pontos={resultado['pontos']} avisos={resultado['avisos']} "
+        f"erro={resultado['erro'] or '-'}"
+    )
+    return resultado
+
+
+def _ler_manifesto_lote(manifest_path):
+    """
+    Lê um manifesto de lote: uma base por linha, no formato 'entrada;saida' (saída opcional).
+    Linhas vazias ou iniciadas por '#' são ignoradas. Caminhos relativos partem da pasta do manifesto.
+    """
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    bases = []
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            partes = [p.strip() for p in re.split(r'[;\t]', line, maxsplit=1)]
+            entrada = os.path.join(manifest_dir, partes[0])
+            saida = os.path.join(manifest_dir, partes[1]) if len(partes) > 1 and partes[1] else ''
+            bases.append((entrada, saida))
+    return bases
+
+
+def _publicar_resumo_lote(doc, resultados):
+    """Recria a aba de resumo do lote com um único setDataArray."""
+    sheets = doc.getSheets()
+    if sheets.hasByName(NOME_ABA_RESUMO_LOTE):
+        sheets.removeByName(NOME_ABA_RESUMO_LOTE)
+    sheets.insertNewByName(NOME_ABA_RESUMO_LOTE, sheets.getCount())
+    sheet = sheets.getByName(NOME_ABA_RESUMO_LOTE)
+
+    data_matrix = [("Base", "Saída", "Status", "Arquivos", "Pontos", "Valores Inválidos", "Avisos", "Tempo (s)", "Erro")]
+    for r in resultados:
+        data_matrix.append((
+            r['entrada'], r['saida'], "ERRO" if r['erro'] else "OK",
+            r['arquivos'], r['pontos'], r['violacoes'], r['avisos'], round(r['tempo'], 3), r['erro']
+        ))
+    data_matrix.append((
+        "TOTAL", "", f"{sum(1 for r in resultados if not r['erro'])}/{len(resultados)} OK",
+        sum(r['arquivos'] for r in resultados), sum(r['pontos'] for r in resultados),
+        sum(r['violacoes'] for r in resultados), sum(r['avisos'] for r in resultados),
+        round(sum(r['tempo'] for r in resultados), 3), ""
+    ))
+    sheet.getCellRangeByPosition(0, 0, len(data_matrix[0]) - 1, len(data_matrix) - 1).setDataArray(tuple(data_matrix))
+    columns = sheet.getColumns()
+    for i in range(len(data_matrix[0])):
+        columns.getByIndex(i).OptimalWidth = True
 
 # ===============================================================
 # ================= FUNÇÃO DE CORES DO TEMA =====================
@@ -935,4 +3006,9 @@ def atualizar_amostras_cores(*args):
 # ===============================================================
 # ================= EXPOSIÇÃO PARA LIBREOFFICE ==================
 # ===============================================================
-g_exportedScripts = importar_dats, exportar_dats, importar_parcial, exportar_parcial, atualizar_amostras_cores
+g_exportedScripts = (
+    importar_dats, exportar_dats, importar_parcial, exportar_parcial, atualizar_amostras_cores,
+    validar_dados, processar_lote, importar_dats_sob_demanda, materializar_abas,
+    censo_dats, iniciar_monitoramento, parar_monitoramento, restaurar_backup,
+    exportar_alteradas, gerar_simul, benchmark_extracao
+)